@@ -0,0 +1,113 @@
+# ZIP bundle writer that compresses the members in parallel. zipfile deflates each member on the calling
+# thread, one after another; here every member is deflated (and checksummed) in a thread pool, where zlib
+# releases the GIL, and the compressed members are then written out in order with their headers and the
+# central directory.
+
+import io
+import os
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# compression level of the bundle: 0 stores the files as they are, 1-9 deflates them (the workbooks are
+# already compressed inside, so the higher levels mostly cost time). Bundles used to be stored; they are now
+# deflated at level 6 unless CLEANING_APP_BUNDLE_COMPRESSION=0 is set.
+COMPRESSION_LEVEL = int(os.environ.get("CLEANING_APP_BUNDLE_COMPRESSION", "6"))
+
+# file attributes given to every member (a regular file readable and writable by its owner), as zipfile's
+# writestr does
+EXTERNAL_ATTR = 0o600 << 16
+
+# the plain ZIP format counts bytes and members in 32 and 16 bits
+MAX_SIZE = 0xFFFFFFFF
+MAX_MEMBERS = 0xFFFF
+
+# the records of the ZIP format (APPNOTE.TXT, sections 4.3.7, 4.3.12 and 4.3.16): the local file header
+# before each member, the central directory entry of each member and the end of central directory record
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+END_RECORD_SIGNATURE = b"PK\x05\x06"
+
+# version needed to extract a member (2.0, for deflate) and version made by (2.0, on Unix, so the file
+# attributes are read as Unix permissions)
+VERSION_NEEDED = 20
+VERSION_MADE_BY = 3 << 8 | 20
+
+# bytes of headers per member on top of its name (written twice), and of the end record
+MEMBER_OVERHEAD = LOCAL_HEADER.size + CENTRAL_HEADER.size
+END_RECORD_SIZE = END_RECORD.size
+
+
+# Define helper function to compress one member: returns its CRC, the compression method and the bytes to
+# store. A file deflating wouldn't make smaller is stored as it is.
+def compress_member(data, level):
+    crc = zlib.crc32(data)
+    if level:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            return crc, zipfile.ZIP_DEFLATED, compressed
+    return crc, zipfile.ZIP_STORED, data
+
+
+# Define helper function to turn a time into the DOS date and time of a ZIP header
+def dos_date_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    return (max(year, 1980) - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+# Define helper function to write a bundle with zipfile, for the rare bundle too large for the plain ZIP format
+def write_zip64(members, level):
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED,
+                         compresslevel=level or None) as zip_file:
+        for file_name, data in members:
+            zip_file.writestr(file_name, data)
+    return zip_buffer.getvalue()
+
+
+# Write (file name, bytes) members into a ZIP file in the given order and return its bytes, deflating the
+# members in parallel on up to `workers` threads
+def write_zip(members, level=None, workers=None):
+    level = COMPRESSION_LEVEL if level is None else level
+    size = END_RECORD_SIZE + sum(len(data) + MEMBER_OVERHEAD + 2 * len(file_name.encode("utf-8"))
+                                 for file_name, data in members)
+    if len(members) > MAX_MEMBERS or size > MAX_SIZE:
+        return write_zip64(members, level)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        compressed = [pool.submit(compress_member, data, level) for _, data in members]
+
+        dos_date, dos_time = dos_date_time(time.time())
+        output = bytearray()
+        central_directory = bytearray()
+        for (file_name, data), future in zip(members, compressed):
+            crc, method, stored = future.result()
+
+            # names outside ASCII are stored as UTF-8, flagged in the header
+            try:
+                encoded_name, flags = file_name.encode("ascii"), 0
+            except UnicodeEncodeError:
+                encoded_name, flags = file_name.encode("utf-8"), 0x800
+
+            offset = len(output)
+            output += LOCAL_HEADER.pack(LOCAL_HEADER_SIGNATURE, VERSION_NEEDED, flags, method, dos_time, dos_date,
+                                        crc, len(stored), len(data), len(encoded_name), 0)
+            output += encoded_name
+            output += stored
+            central_directory += CENTRAL_HEADER.pack(CENTRAL_HEADER_SIGNATURE, VERSION_MADE_BY, VERSION_NEEDED,
+                                                     flags, method, dos_time, dos_date, crc, len(stored), len(data),
+                                                     len(encoded_name), 0, 0, 0, 0, EXTERNAL_ATTR, offset)
+            central_directory += encoded_name
+
+    directory_offset = len(output)
+    output += central_directory
+    output += END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, len(members), len(members), len(central_directory),
+                              directory_offset, 0)
+    return bytes(output)
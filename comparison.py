@@ -0,0 +1,121 @@
+# Leader-Team comparisons for every Leader/Team pair uploaded in one batch
+
+import re
+
+import pandas as pd
+
+from summary import stack_frames, summarize_stacked
+from writers import write_workbook
+
+
+COMPARISON_FILE_NAME = "Leader-Team_Comparison.xlsx"
+
+# column widths of the 'Comparison' and 'Categories' sheets
+QUESTION_COLUMN_WIDTHS = {'A': 13, 'B': 75, 'C': 13, 'D': 75, 'E': 13, 'F': 13}
+CATEGORY_COLUMN_WIDTHS = {'A': 13, 'B': 30, 'C': 19, 'D': 13, 'E': 13, 'F': 13}
+
+# 'Leader' / 'Team' as a separate word of the file name, e.g. 'Acme Leader.xlsx' or 'acme_team_Q3.xlsx'
+TEMPLATE_TOKEN = re.compile(r'(^|[\s_\-.])(leader|team)(?=$|[\s_\-.])', re.IGNORECASE)
+
+
+# Define helper function to derive the pair name of a Leader or Team file by dropping the extension and the
+# 'Leader'/'Team' word, so 'Acme Leader.xlsx' and 'Acme Team.xlsx' both become 'Acme'
+def pair_name(file_name):
+    stem = file_name.rsplit('.', 1)[0]
+    return re.sub(r'[\s_\-.]+', ' ', TEMPLATE_TOKEN.sub(' ', stem)).strip()
+
+
+# Define helper function to suggest a Team file for every Leader file. A lone Leader and Team file are always
+# paired; otherwise files are paired by name and a Leader file without a match maps to None.
+def default_pairs(leader_names, team_names):
+    if len(leader_names) == 1 and len(team_names) == 1:
+        return {leader_names[0]: team_names[0]}
+
+    teams_by_name = {}
+    for team_name in team_names:
+        teams_by_name.setdefault(pair_name(team_name).lower(), team_name)
+
+    return {leader_name: teams_by_name.pop(pair_name(leader_name).lower(), None) for leader_name in leader_names}
+
+
+# Define helper function to turn a {Leader file: Team file} mapping into (pair ID, Leader file, Team file)
+# tuples, naming each pair after its files and keeping the IDs unique
+def build_pairs(mapping):
+    pairs = []
+    seen = set()
+    for leader_name, team_name in mapping.items():
+        if team_name is None:
+            continue
+
+        pair_id = pair_name(leader_name) or pair_name(team_name) or "Leader-Team"
+        if pair_id in seen:
+            pair_id = f"{pair_id} ({len(pairs) + 1})"
+        seen.add(pair_id)
+        pairs.append((pair_id, leader_name, team_name))
+
+    return pairs
+
+
+# Compare every pair at once. `surveys` holds (file name, template, question table) tuples and `pairs` the
+# output of build_pairs. Returns the per-question comparison and the 2nd/3rd-order category comparison, both
+# keyed by pair ID.
+def compare_pairs(surveys, pairs):
+    frames = {name: df for name, _, df in surveys}
+    pair_ids = [pair_id for pair_id, _, _ in pairs]
+
+    # stack the Leader and Team files of every pair, keyed by pair ID
+    leaders = stack_frames([frames[leader_name]
+                           for _, leader_name, _ in pairs], pair_ids, key_name='Pair')
+    teams = stack_frames([frames[team_name]
+                         for _, _, team_name in pairs], pair_ids, key_name='Pair')
+
+    # create the comparison dataframe for every pair in one merge
+    questions = pd.merge(
+        leaders[['Pair', 'Question Order', 'Questions', 'Avg. Score (%)']],
+        teams[['Pair', 'Question Order', 'Questions', 'Avg. Score (%)']],
+        on=['Pair', 'Question Order'], suffixes=("_Leader", "_Team"))
+    questions = questions.rename(
+        columns={"Avg. Score (%)_Leader": "Score_Leader", "Avg. Score (%)_Team": "Score_Team"})
+    questions = questions[[
+        'Pair', 'Question Order', 'Questions_Leader', 'Score_Leader', 'Questions_Team', 'Score_Team']]
+    questions['Score_delta'] = questions['Score_Leader'] - \
+        questions['Score_Team']
+    questions = questions.sort_values(
+        by=["Pair", "Score_delta"], ascending=[True, False], kind="stable")
+
+    # category-level deltas, from the same summary engine used for the cleaned workbooks
+    categories = pd.merge(
+        summarize_stacked(leaders, 'Pair')[
+            ['Pair', 'Level', 'Category', 'Split', 'Mean']],
+        summarize_stacked(teams, 'Pair')[
+            ['Pair', 'Level', 'Category', 'Split', 'Mean']],
+        on=['Pair', 'Level', 'Category', 'Split'], suffixes=("_Leader", "_Team"))
+    categories = categories[categories['Level'].isin(['2nd', '3rd'])]
+    categories = categories.rename(columns={
+        "Level": "Order", "Split": "3rd-Order Category", "Mean_Leader": "Score_Leader", "Mean_Team": "Score_Team"})
+    categories['Order'] = categories['Order'].astype(str) + "-Order"
+    categories['Score_delta'] = categories['Score_Leader'] - \
+        categories['Score_Team']
+
+    return questions.reset_index(drop=True), categories.reset_index(drop=True)
+
+
+# Write one comparison workbook per pair. A single pair keeps the original file name; several pairs get
+# the pair ID as a prefix.
+def write_comparisons(questions, categories, engine=None):
+    categories_by_pair = dict(list(categories.groupby('Pair', sort=False)))
+    pair_ids = list(pd.unique(questions['Pair']))
+
+    comparison_files = []
+    for pair_id, pair_questions in questions.groupby('Pair', sort=False):
+        file_name = COMPARISON_FILE_NAME if len(
+            pair_ids) == 1 else f"{pair_id} {COMPARISON_FILE_NAME}"
+
+        sheets = {'Comparison': (pair_questions.drop(columns='Pair'), QUESTION_COLUMN_WIDTHS)}
+        if pair_id in categories_by_pair:
+            sheets['Categories'] = (categories_by_pair[pair_id].drop(
+                columns='Pair'), CATEGORY_COLUMN_WIDTHS)
+
+        comparison_files.append((file_name, write_workbook(sheets, engine)))
+
+    return comparison_files
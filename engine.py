@@ -0,0 +1,859 @@
+# Cleaning engine: turns one Survey Monkey export into the cleaned workbook, without any Streamlit calls
+
+import gc
+import hashlib
+import io
+import os
+import tracemalloc
+from collections import namedtuple
+from copy import copy
+
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
+
+from bundling import write_zip
+from errors import CleaningError
+from extraction import (extract_survey_frame, assign_categories, is_survey_sheet, pack_frame, question_signature,
+                        unpack_frame)
+from metrics import inc, observe, timed
+from profiling import snapshot_workbook
+from summary import (BOOTSTRAP_RESAMPLES, CONFIDENCE, pack_summary, summarize, unpack_summary, wide_table,
+                     wide_tables)
+from templates import detect_template
+
+
+# result of cleaning one survey sheet: the survey name (the file name, or the file and sheet name when a
+# workbook holds several surveys), the sheet name, the detected template, the question table packed into
+# arrays (question texts, difficulties, float32 scores and int8 category codes, see extraction.pack_frame),
+# and the category summary with confidence intervals packed into one array (see summary.pack_summary).
+# Results are kept compact so many of them can be held and passed between the stages cheaply;
+# question_table and category_summary rebuild the DataFrames when they are needed.
+CleanedSheet = namedtuple(
+    'CleanedSheet', ['name', 'sheet_name', 'template', 'questions', 'difficulty', 'scores', 'codes', 'statistics'])
+
+# title of the sheet holding the category averages with their confidence intervals
+INTERVAL_SHEET_TITLE = "Confidence Intervals"
+
+# result of cleaning one file: the cleaned file name, the CleanedSheet of every survey sheet, the cleaned
+# workbook as bytes and, in memory-budget mode, the peak traced memory in bytes
+CleanedFile = namedtuple(
+    'CleanedFile', ['file_name', 'sheets', 'data', 'peak_memory'], defaults=[None])
+
+# size guardrails, configurable through environment variables (0 turns a limit off)
+MAX_FILE_MB = float(os.environ.get("CLEANING_APP_MAX_FILE_MB", "25"))
+MAX_ROWS = int(os.environ.get("CLEANING_APP_MAX_ROWS", "20000"))
+
+# memory-budget mode frees every workbook as soon as it is saved and measures each file's peak memory
+MEMORY_BUDGET = os.environ.get(
+    "CLEANING_APP_MEMORY_BUDGET", "").lower() in ("1", "true", "yes")
+
+
+# Rebuild the question table (with its category columns) of a cleaned sheet
+def question_table(sheet):
+    return unpack_frame(sheet.questions, sheet.difficulty, sheet.scores, sheet.codes)
+
+
+# Rebuild the long category summary (with confidence intervals) of a cleaned sheet
+def category_summary(sheet):
+    return unpack_summary(sheet.statistics, sheet.name)
+
+
+# Define helper function to hash a file's content, so identical uploads are recognized whatever their name
+def content_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+# Define helper function to add the "_clean" suffix to the file name before the extension
+def cleaned_name(file_name):
+    return f"{file_name.rsplit('.', 1)[0]}_clean.xlsx"
+
+
+# Define helper function to write a wide summary table: the category labels go on the header row, with one
+# row of values per table row below it and the row labels in column A. The values are written with their
+# number format, either one for the whole table or one per row.
+def write_summary_table(ws, table, header_row, title, number_format=None):
+    ws.cell(row=header_row, column=1, value=title)
+    for column, category in enumerate(table.columns, start=2):
+        ws.cell(row=header_row, column=column, value=category)
+
+    row_formats = number_format if isinstance(number_format, list) else [number_format] * len(table)
+    for row, (label, values), row_format in zip(range(header_row + 1, header_row + 1 + len(table)),
+                                                table.iterrows(), row_formats):
+        ws.cell(row=row, column=1, value=label)
+        for column, value in enumerate(values, start=2):
+            # leave statistics that can't be computed (e.g. an interval from a single question) blank
+            cell = ws.cell(row=row, column=column, value=None if pd.isna(value) else float(value))
+            if row_format is not None:
+                cell.number_format = row_format
+
+
+# Define helper function to write the category averages of one survey with their confidence intervals and
+# question counts, one wide table per level like the summary tables on the survey sheet
+def write_interval_sheet(ws, summary):
+    ws["A1"] = (f"Category averages with {CONFIDENCE:.0%} bootstrap confidence intervals "
+                f"({BOOTSTRAP_RESAMPLES:,} resamples of each category's questions)")
+    ws["A1"].font = Font(name="Arial", size=12, bold=True)
+
+    statistics = ['Mean', 'CI Low', 'CI High', 'Count']
+    header_row = 3
+    for level in wide_tables(summary):
+        # keep the rows of each split together: average, CI bounds and number of questions
+        tables = [wide_table(summary, level, statistic) for statistic in statistics]
+        n_splits = len(tables[0])
+        table = pd.concat(tables).iloc[[split + position * n_splits for split in range(n_splits)
+                                        for position in range(len(statistics))]]
+        row_formats = ['0' if statistics[offset % len(statistics)] == 'Count' else '0.0'
+                       for offset in range(len(table))]
+        write_summary_table(ws, table, header_row, f"{level}-Order Category", row_formats)
+
+        for row in ws.iter_rows(min_row=header_row, max_row=header_row + len(table), max_col=table.shape[1] + 1):
+            for cell in row:
+                cell.font = Font(name="Arial", size=11, bold=cell.column == 1)
+
+        header_row += len(table) + 2
+
+    ws.column_dimensions['A'].width = 30
+    for column in range(2, 13):
+        ws.column_dimensions[get_column_letter(column)].width = 19
+
+
+# Define helper function to read a survey sheet's question table, detect its template, add the category
+# columns and compute every category average (and its bootstrap confidence interval) in one pass. This is
+# the part of cleaning the preview needs; it only reads the sheet, so it also works in read-only mode.
+# Without intervals the (costly) bootstrap is skipped. Returns the template, the question table and the long
+# summary.
+def analyze_sheet(ws, name, intervals=True):
+    # Extract the question table (sorted, with a sequential "Question Order") from row 24 down
+    df, missing_questions = extract_survey_frame(ws)
+
+    # figure out which template was uploaded from its question sequence
+    try:
+        template = detect_template(question_signature(df))
+    except ValueError as error:
+        message = str(error)
+        if missing_questions:
+            listed = ", ".join(f"Q{number}" for number in missing_questions)
+            message += f" Question(s) {listed} are missing from the question sequence."
+        raise CleaningError(message, "unknown_template") from None
+
+    df = assign_categories(df, template)
+    return template, df, summarize(df, name, intervals=intervals)
+
+
+# Define helper function to clean one survey sheet in place. `name` labels the survey in the summaries.
+def clean_sheet(ws, name):
+    # Iterate over all merged cells and unmerge them
+    for merged_cell_range in list(ws.merged_cells.ranges):
+        ws.unmerge_cells(str(merged_cell_range))
+
+    # check to see if the uploaded file has already been cleaned by seeing if cell D23 is empty. If it is, we're good to go.
+    if ws["D23"].value is not None:
+        raise CleaningError(
+            "The uploaded file appears to have been processed already! Please upload a different file.",
+            "already_processed")
+
+    # Add new columns & formatting
+    ws["D23"] = "Question Order"
+    ws["D23"].font = copy(ws["C23"].font)
+    ws["D23"].fill = copy(ws["C23"].fill)
+    ws["D23"].alignment = copy(ws["C23"].alignment)
+
+    ws["E23"] = "1st-Order Category"
+    ws["E23"].font = copy(ws["C23"].font)
+    ws["E23"].fill = copy(ws["C23"].fill)
+    ws["E23"].alignment = copy(ws["C23"].alignment)
+
+    ws["F23"] = "2nd-Order Category"
+    ws["F23"].font = copy(ws["C23"].font)
+    ws["F23"].fill = copy(ws["C23"].fill)
+    ws["F23"].alignment = copy(ws["C23"].alignment)
+
+    # read, categorize and summarize the question table, before any of the layout work
+    template, df, summary = analyze_sheet(ws, name)
+
+    # convert overall average
+    overall_avg = df["Avg. Score (%)"].mean()
+
+    # lay the category averages out wide, rounded to whole numbers for the summary tables
+    summary_tables = wide_tables(summary, decimals=0)
+
+    # fill out templates
+    if template == 'Review':
+
+        # Start from A22 and find the last filled cell in column A
+        current_row = 22
+        while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
+            current_row += 1  # Move down
+
+        # Move one row below the last filled cell
+        start_row = current_row + 1
+
+        # Insert blank rows after the last row written
+        ws.insert_rows(current_row, 8)
+
+        # Add the overall average
+        ws["A63"] = "Overall Average (%)"
+        ws["B63"] = round(overall_avg, 0)
+        ws["B63"].number_format = '0.0'
+
+        # Per Uncle David's request, show category averages in wide format instead of long format
+        write_summary_table(
+            ws, summary_tables["1st"], 65, "1st-Order Category", '0.0')
+        write_summary_table(
+            ws, summary_tables["2nd"], 68, "2nd-Order Category", '0.0')
+
+        # Format the newly-created cells
+        start_row = 24
+        end_row = 70
+        start_col = 1  # Column A (1-indexed)
+        end_col = 11
+
+        # Define the font style
+        custom_font = Font(name="Arial", size=11)
+
+        # Apply the font style to each cell in the range
+        for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
+            for cell in row:
+                cell.font = custom_font
+
+        # format the headers - Overall average
+        ws["A63"].font = Font(name="Arial", size=12, bold=True)
+        ws["B63"].font = Font(name="Arial", size=12, bold=True)
+
+        # First-Order Average
+        ws["A65"].font = Font(name="Arial", size=11, bold=True)
+        ws["A66"].font = Font(name="Arial", size=11, bold=True)
+
+        # Second-Order Average
+        ws["A68"].font = Font(name="Arial", size=11, bold=True)
+        ws["A69"].font = Font(name="Arial", size=11, bold=True)
+
+        # Center alignment
+        ws["A65"].alignment = copy(ws["C23"].alignment)
+        ws["A66"].alignment = copy(ws["C23"].alignment)
+        ws["A68"].alignment = copy(ws["C23"].alignment)
+        ws["A69"].alignment = copy(ws["C23"].alignment)
+
+        # row height
+        for row in range(63, 71):
+            ws.row_dimensions[row].height = 15
+
+        # get standard deviation values in template
+        std_dev_values = []
+
+        # Start iterating from the first cell in column C
+        column = 3  # Column C
+        row = 1  # Start at the first row
+        max_row = 5000
+
+        # Iterate through column C until the end and collect STD values
+        while row <= max_row:
+            cell_value = ws.cell(row=row, column=column).value
+
+            # Check if the cell contains 'Standard Deviation'
+            if cell_value == "Standard Deviation":
+                # Get the value in the cell below
+                next_cell_value = ws.cell(
+                    row=row + 1, column=column).value
+                # if next_cell_value is not None, append to std_dev_values
+                if next_cell_value is not None:
+                    std_dev_values.append(next_cell_value)
+
+                # Move the row pointer down by 2 to skip the value we just processed
+                row += 2
+            else:
+                # Move to the next row
+                row += 1
+
+    elif template == 'No leader':
+
+        # Start from A22 and find the last filled cell in column A
+        current_row = 22
+        while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
+            current_row += 1  # Move down
+
+        # Move one row below the last filled cell
+        start_row = current_row + 1
+
+        # Insert blank rows after the last row written
+        ws.insert_rows(current_row, 8)
+
+        # Add the overall average
+        ws["A72"] = "Overall Average (%)"
+        ws["B72"] = round(overall_avg, 0)
+        ws["B72"].number_format = '0.0'
+
+        # Per Uncle David's request, show category averages in wide format instead of long format
+        write_summary_table(
+            ws, summary_tables["1st"], 74, "1st-Order Category", '0.0')
+        write_summary_table(
+            ws, summary_tables["2nd"], 77, "2nd-Order Category", '0.0')
+
+        # Define the range of cells
+        start_row = 24
+        end_row = 79
+        start_col = 1  # Column A (1-indexed)
+        end_col = 11  # Column C (1-indexed)
+
+        # Define the font style
+        custom_font = Font(name="Arial", size=11)
+
+        # Apply the font style to each cell in the range
+        for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
+            for cell in row:
+                cell.font = custom_font
+
+        # format the headers - overall average
+        ws["A72"].font = Font(name="Arial", size=12, bold=True)
+        ws["B72"].font = Font(name="Arial", size=12, bold=True)
+
+        # First-Order Average
+        ws["A74"].font = Font(name="Arial", size=11, bold=True)
+        ws["A75"].font = Font(name="Arial", size=11, bold=True)
+
+        # Second-Order Average
+        ws["A77"].font = Font(name="Arial", size=11, bold=True)
+        ws["A78"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A74"].alignment = copy(ws["C23"].alignment)
+        ws["A75"].alignment = copy(ws["C23"].alignment)
+        ws["A77"].alignment = copy(ws["C23"].alignment)
+        ws["A78"].alignment = copy(ws["C23"].alignment)
+
+        # row height
+        for row in range(71, 79):
+            ws.row_dimensions[row].height = 15
+
+        # get standard deviation values in template
+        std_dev_values = []
+
+        # Start iterating from the first cell in column C
+        column = 3  # Column C
+        row = 1  # Start at the first row
+        max_row = 5000
+
+        # Iterate through column C until the end
+        while row <= max_row:
+            cell_value = ws.cell(row=row, column=column).value
+
+            # Check if the cell contains 'Standard Deviation'
+            if cell_value == "Standard Deviation":
+                # Get the value in the cell below
+                next_cell_value = ws.cell(
+                    row=row + 1, column=column).value
+                # if next_cell_value is not None, append to std_dev_values as a float
+                if next_cell_value is not None:
+                    next_cell_value = float(next_cell_value)
+                    std_dev_values.append(next_cell_value)
+
+                # Move the row pointer down by 2 to skip the value we just processed
+                row += 2
+            else:
+                # Move to the next row
+                row += 1
+
+    elif template == 'Leader':
+
+        # Start from A22 and find the last filled cell in column A
+        current_row = 22
+        while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
+            current_row += 1  # Move down
+
+        # Move one row below the last filled cell
+        start_row = current_row + 1
+
+        # Insert blank rows after the last row written
+        ws.insert_rows(current_row, 12)
+
+        # Add the overall average
+        ws["A105"] = "Overall Average"
+        ws["B105"] = int(overall_avg)
+        ws["B105"].number_format = '0'
+
+        # Per Uncle David's request, show category averages in wide format instead of long format
+        write_summary_table(
+            ws, summary_tables["1st"], 107, "1st-Order Category", '0')
+        write_summary_table(
+            ws, summary_tables["2nd"], 110, "2nd-Order Category", '0')
+        write_summary_table(
+            ws, summary_tables["3rd"], 113, "3rd-Order Category", '0')
+
+        # Define the range of cells
+        start_row = 24
+        end_row = 116
+        start_col = 1  # Column A (1-indexed)
+        end_col = 11  # Column C (1-indexed)
+
+        # Define the font style
+        custom_font = Font(name="Arial", size=11)
+
+        # Apply the font style to each cell in the range
+        for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
+            for cell in row:
+                cell.font = custom_font
+
+        # format the headers
+        ws["A105"].font = Font(name="Arial", size=12, bold=True)
+        ws["B105"].font = Font(name="Arial", size=12, bold=True)
+
+        ws["A107"].font = Font(name="Arial", size=11, bold=True)
+        ws["A108"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A110"].font = Font(name="Arial", size=11, bold=True)
+        ws["A111"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A113"].font = Font(name="Arial", size=11, bold=True)
+        ws["A114"].font = Font(name="Arial", size=11, bold=True)
+        ws["A115"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A107"].alignment = copy(ws["C23"].alignment)
+        ws["A108"].alignment = copy(ws["C23"].alignment)
+
+        ws["A110"].alignment = copy(ws["C23"].alignment)
+        ws["A111"].alignment = copy(ws["C23"].alignment)
+        ws["A113"].alignment = copy(ws["C23"].alignment)
+        ws["A114"].alignment = copy(ws["C23"].alignment)
+        ws["A115"].alignment = copy(ws["C23"].alignment)
+
+        # row height
+        for row in range(104, 116):
+            ws.row_dimensions[row].height = 15
+
+    else:  # Team template
+
+        # Start from A22 and find the last filled cell in column A
+        current_row = 22
+        while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
+            current_row += 1  # Move down
+
+        # Move one row below the last filled cell
+        start_row = current_row + 1
+
+        # Insert blank rows after the last row written
+        ws.insert_rows(current_row, 12)
+
+        # Add the overall average
+        ws["A105"] = "Overall Average"
+        ws["B105"] = round(overall_avg, 0)
+        ws["B105"].number_format = '0'
+
+        # Per Uncle David's request, show category averages in wide format instead of long format
+        write_summary_table(
+            ws, summary_tables["1st"], 107, "1st-Order Category", '0')
+        write_summary_table(
+            ws, summary_tables["2nd"], 110, "2nd-Order Category", '0')
+        write_summary_table(
+            ws, summary_tables["3rd"], 113, "3rd-Order Category", '0')
+
+        # Define the range of cells
+        start_row = 24
+        end_row = 116
+        start_col = 1  # Column A (1-indexed)
+        end_col = 11  # Column C (1-indexed)
+
+        # Define the font style
+        custom_font = Font(name="Arial", size=11)
+
+        # Apply the font style to each cell in the range
+        for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
+            for cell in row:
+                cell.font = custom_font
+
+        # format the headers
+        ws["A105"].font = Font(name="Arial", size=12, bold=True)
+        ws["B105"].font = Font(name="Arial", size=12, bold=True)
+
+        ws["A107"].font = Font(name="Arial", size=11, bold=True)
+        ws["A108"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A110"].font = Font(name="Arial", size=11, bold=True)
+        ws["A111"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A113"].font = Font(name="Arial", size=11, bold=True)
+        ws["A114"].font = Font(name="Arial", size=11, bold=True)
+        ws["A115"].font = Font(name="Arial", size=11, bold=True)
+
+        ws["A107"].alignment = copy(ws["C23"].alignment)
+        ws["A108"].alignment = copy(ws["C23"].alignment)
+
+        ws["A110"].alignment = copy(ws["C23"].alignment)
+        ws["A111"].alignment = copy(ws["C23"].alignment)
+        ws["A113"].alignment = copy(ws["C23"].alignment)
+        ws["A114"].alignment = copy(ws["C23"].alignment)
+        ws["A115"].alignment = copy(ws["C23"].alignment)
+
+        # row height
+        for row in range(104, 116):
+            ws.row_dimensions[row].height = 15
+
+        # get standard deviation values in template
+        std_dev_values = []
+
+        # Start iterating from the first cell in column C
+        column = 3  # Column C
+        row = 1  # Start at the first row
+        max_row = 5000
+
+        # Iterate through column C until the end
+        while row <= max_row:
+            cell_value = ws.cell(row=row, column=column).value
+
+            # Check if the cell contains 'Standard Deviation'
+            if cell_value == "Standard Deviation":
+                # Get the value in the cell below
+                next_cell_value = ws.cell(
+                    row=row + 1, column=column).value
+                # if next_cell_value is not None, append to std_dev_values as a float
+                if next_cell_value is not None:
+                    next_cell_value = float(next_cell_value)
+                    std_dev_values.append(next_cell_value)
+
+                # Move the row pointer down by 2 to skip the value we just processed
+                row += 2
+            else:
+                # Move to the next row
+                row += 1
+
+    # For the Leader and Team templates, there will be a 3rd order category
+    if template == 'Leader' or template == 'Team':
+
+        # label Column G, which won't be necessary for the other 2 templates
+        ws["G23"] = "3rd-Order Category"
+        ws["G23"].font = copy(ws["C23"].font)
+        ws["G23"].fill = copy(ws["C23"].fill)
+        ws["G23"].alignment = copy(ws["C23"].alignment)
+
+        row = 24  # Starting from row 24
+        for idx, row_data in df.iterrows():
+            ws[f"A{row}"] = row_data["Questions"]
+            ws[f"B{row}"] = row_data["Difficulty"]
+            ws[f"C{row}"] = row_data["Avg. Score (%)"]
+            ws[f"D{row}"] = row_data["Question Order"]
+            ws[f"E{row}"] = row_data["1st-Order Category"]
+            ws[f"F{row}"] = row_data["2nd-Order Category"]
+            ws[f"G{row}"] = row_data["3rd-Order Category"]
+            row += 1  # Move to the next row
+        ws.column_dimensions['G'].width = 18
+
+    # remove 3rd-order category for the 'Leader' template
+    if template == 'Leader':
+        ws.delete_rows(113, 4)
+
+    if template == 'Team':
+        start_col, end_col = 3, 10
+
+        # Loop backward through columns to shift values (with their number format) right
+        for col in range(end_col, start_col - 1, -1):  # From J to C
+            for row in range(113, 116):  # Rows 113 to 115
+                source_cell = ws.cell(row=row, column=col)
+                target_cell = ws.cell(row=row, column=col + 1,
+                                      value=source_cell.value)
+                target_cell.number_format = source_cell.number_format
+                # Clear old cell
+                source_cell.value = None
+
+        # now insert 'Health' into column C
+        ws["C113"] = "Health"
+        ws["C114"] = "N/A"
+        ws["C115"] = "N/A"
+
+        # now right-align cells C114 and C115
+        ws["C114"].alignment = Alignment(horizontal="right")
+        ws["C115"].alignment = Alignment(horizontal="right")
+
+    # For the Review and No Leader templates, there will be no 3rd order category
+    else:
+        row = 24  # Starting from row 24
+        for idx, row_data in df.iterrows():
+            ws[f"A{row}"] = row_data["Questions"]
+            ws[f"B{row}"] = row_data["Difficulty"]
+            ws[f"C{row}"] = row_data["Avg. Score (%)"]
+            ws[f"D{row}"] = row_data["Question Order"]
+            ws[f"E{row}"] = row_data["1st-Order Category"]
+            ws[f"F{row}"] = row_data["2nd-Order Category"]
+            row += 1  # Move to the next row
+
+    # for only the Team, Review, and No Leader templates, shift data over to make room for the standard deviation values
+    if template != 'Leader':
+        # Find the data range starting from D23
+        start_row = 23
+        start_col = 4  # Column D
+
+        # Find the last row in column D (stop when an empty cell is encountered)
+        end_row = start_row
+        while ws.cell(row=end_row, column=start_col).value is not None:
+            end_row += 1
+        end_row -= 1  # Adjust to the last filled row
+
+        # Find the last column (stop when an empty cell is encountered in the header row)
+        end_col = start_col
+        while ws.cell(row=start_row, column=end_col).value is not None:
+            end_col += 1
+        end_col -= 1  # Adjust to the last filled column
+
+        # Shift data one column to the right
+        for row in range(start_row, end_row + 1):
+            # Move backward to avoid overwriting
+            for col in range(end_col, start_col - 1, -1):
+                source_cell = ws.cell(row=row, column=col)
+                target_cell = ws.cell(row=row, column=col + 1)
+
+                # Copy value
+                target_cell.value = source_cell.value
+
+                # Copy style if present
+                if source_cell.has_style:
+                    target_cell._style = source_cell._style
+
+                # Clear the original cell
+                source_cell.value = None
+
+        # Now input the standard deviation values
+        ws["D23"] = "Standard deviation"
+        start_row = 24
+        start_column = 4  # Column D
+
+        # Write the values from the list into column D, starting at D24
+        for i, value in enumerate(std_dev_values):
+            cell = ws.cell(row=start_row + i, column=start_column)
+            cell.value = float(value)
+
+    # any final adjustments to the table
+    ws["C23"] = "Avg. Score (%)"
+    ws.column_dimensions['A'].width = 50
+    ws.column_dimensions['B'].width = 14
+    ws.column_dimensions['C'].width = 17
+    ws.column_dimensions['D'].width = 17
+    ws.column_dimensions['E'].width = 14
+    ws.column_dimensions['F'].width = 19
+    ws.column_dimensions['G'].width = 19
+    ws.column_dimensions['H'].width = 23
+    ws.column_dimensions['I'].width = 22
+    ws.column_dimensions['J'].width = 15
+    ws.column_dimensions['K'].width = 21
+
+    return CleanedSheet(name, ws.title, template, *pack_frame(df), pack_summary(summary))
+
+
+# Define helper function to run `process(ws, name)` on the survey sheets of a workbook and return the results:
+# by default the active sheet only, with all_sheets every survey sheet. Each survey is named after its file,
+# or after its file and sheet when the workbook holds several, and errors from an all-sheets workbook name the
+# sheet they came from.
+def process_survey_sheets(wb, file_name, all_sheets, process):
+    if not all_sheets:
+        return [process(wb.active, file_name)]
+
+    worksheets = [ws for ws in wb.worksheets if is_survey_sheet(ws)]
+    if not worksheets:
+        raise CleaningError(
+            "No survey sheets were found in the workbook.", "no_survey_sheet")
+
+    # name each survey after its sheet, unless the workbook holds just the one
+    stem = file_name.rsplit('.', 1)[0]
+    results = []
+    for ws in worksheets:
+        name = file_name if len(worksheets) == 1 else f"{stem} - {ws.title}"
+        try:
+            results.append(process(ws, name))
+        except ValueError as error:
+            raise CleaningError(f"Sheet '{ws.title}': {error}",
+                                getattr(error, "reason", "invalid_survey")) from None
+    return results
+
+
+# Define helper function to load an export that passed the pre-flight checks and clean it in place. By
+# default only the active sheet is cleaned; with all_sheets every survey sheet is. Returns the workbook and
+# the CleanedSheet of every survey sheet, for serialize_workbook.
+def load_and_clean(file_name, file_data, all_sheets=False):
+    # Load the workbook using openpyxl
+    with timed("load"):
+        wb = openpyxl.load_workbook(file_data)
+
+    with timed("clean"):
+        sheets = process_survey_sheets(wb, file_name, all_sheets, clean_sheet)
+
+        # add the confidence intervals of every survey on a sheet of their own, since the survey sheets have no
+        # room between their summary tables
+        for sheet in sheets:
+            title = INTERVAL_SHEET_TITLE if len(sheets) == 1 else f"{sheet.sheet_name} CI"[:31]
+            write_interval_sheet(wb.create_sheet(title), category_summary(sheet))
+
+    return wb, sheets
+
+
+# Define helper function to save a cleaned workbook and wrap it up as a CleanedFile
+def serialize_workbook(file_name, wb, sheets):
+    # Add "_clean" suffix to the file name before the extension
+    clean_file_name = cleaned_name(file_name)
+
+    # Save the modified workbook to a BytesIO object and keep just its bytes
+    with timed("save"):
+        cleaned_file = io.BytesIO()
+        wb.save(cleaned_file)
+
+    # when profiling, record what the open workbook and its saved bytes hold
+    snapshot_workbook()
+
+    return CleanedFile(clean_file_name, sheets, cleaned_file.getvalue())
+
+
+# Define helper function to clean an export that passed the pre-flight checks, within one load and save of
+# the workbook
+def clean_file_data(file_name, file_data, all_sheets=False):
+    return serialize_workbook(file_name, *load_and_clean(file_name, file_data, all_sheets))
+
+
+# Define helper function to enforce the file size and row limits before the workbook is fully loaded. The row
+# count comes from the sheet's dimension record, which read-only mode reads without loading any cells. With
+# all_sheets the limit applies to the longest sheet.
+def check_limits(file_data, max_file_mb=MAX_FILE_MB, max_rows=MAX_ROWS, all_sheets=False):
+    size = file_data.seek(0, io.SEEK_END)
+    file_data.seek(0)
+    if max_file_mb and size > max_file_mb * 2**20:
+        raise CleaningError(
+            f"The file is {size / 2**20:.1f} MB, which is over the {max_file_mb:g} MB limit.", "too_large")
+
+    if max_rows:
+        wb = openpyxl.load_workbook(file_data, read_only=True)
+        worksheets = wb.worksheets if all_sheets else [wb.active]
+        rows = max((ws.max_row or 0 for ws in worksheets), default=0)
+        wb.close()
+        file_data.seek(0)
+        if rows > max_rows:
+            raise CleaningError(
+                f"The sheet has {rows:,} rows, which is over the {max_rows:,} row limit.", "too_many_rows")
+
+
+# Define helper function to check the file extension of the uploaded file. If it's not XLSX, raise an error
+def check_extension(file_name):
+    if file_name.split('.')[-1] != 'xlsx':
+        raise CleaningError(
+            "The uploaded file is not in the correct format. Please upload an Excel file.", "wrong_format")
+
+
+# Define helper function to check an export's file extension and size limits. Returns the export as a binary
+# file object, ready to be loaded.
+def check_export(file_name, source, all_sheets=False):
+    check_extension(file_name)
+
+    file_data = source if hasattr(source, "read") else io.BytesIO(source)
+    check_limits(file_data, all_sheets=all_sheets)
+    return file_data
+
+
+# Define helper function for the pre-flight checks of an export before it is cleaned (see check_export),
+# counted in the metrics registry
+def preflight(file_name, source, all_sheets=False):
+    with timed("check"):
+        file_data = check_export(file_name, source, all_sheets)
+
+    size = file_data.seek(0, io.SEEK_END)
+    file_data.seek(0)
+    inc("cleaning_input_bytes_total", size)
+    observe("cleaning_input_size_bytes", size)
+    return file_data
+
+
+# Define helper function to clean one export without the metrics bookkeeping (see clean_workbook)
+def clean_source(file_name, source, memory_budget, all_sheets):
+    file_data = preflight(file_name, source, all_sheets)
+
+    if not memory_budget:
+        return clean_file_data(file_name, file_data, all_sheets)
+
+    # tracemalloc is process-wide; leave it running if someone else (e.g. the profiling mode) started it
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        cleaned = clean_file_data(file_name, file_data, all_sheets)
+
+        # the workbook's object graph is full of reference cycles, so collect it now rather than at the
+        # garbage collector's next pass
+        gc.collect()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    return cleaned._replace(peak_memory=peak_memory)
+
+
+# Define helper function to count a finished export in the metrics registry: the cleaned file, or the error
+# it failed with (labelled by its reason)
+def record_outcome(cleaned=None, error=None):
+    if error is not None:
+        reason = getattr(error, "reason", "invalid_survey") if isinstance(
+            error, ValueError) else "unreadable"
+        inc("cleaning_failures_total", reason=reason)
+        return
+
+    inc("cleaning_files_processed_total")
+    inc("cleaning_output_bytes_total", len(cleaned.data))
+
+
+# Clean one uploaded export, given as bytes or as a binary file object (such as a Streamlit upload, which is
+# used as-is instead of being copied). With all_sheets every survey sheet in the workbook is cleaned, not just
+# the active one. Raises a ValueError with a message for the user if the file can't be cleaned. Every call is
+# counted in the metrics registry, with failures labelled by reason.
+def clean_workbook(file_name, source, memory_budget=None, all_sheets=False):
+    memory_budget = MEMORY_BUDGET if memory_budget is None else memory_budget
+
+    try:
+        with timed("total"):
+            cleaned = clean_source(file_name, source, memory_budget, all_sheets)
+    except Exception as error:
+        record_outcome(error=error)
+        raise
+
+    record_outcome(cleaned)
+    return cleaned
+
+
+# Preview one uploaded export: read and summarize its survey sheets without cleaning the workbook. The
+# workbook is streamed in read-only mode and nothing is unmerged, formatted, laid out or saved, so this takes
+# a fraction of the time of clean_workbook. Returns one CleanedSheet per survey sheet (with the same names as
+# clean_workbook gives them, but no confidence intervals in the summary) and raises a ValueError with a message for the user if the file can't be read
+# as a survey. With allow_cleaned, workbooks that were cleaned already are read too, since cleaning leaves the
+# question table (sorted) in place.
+def preview_workbook(file_name, source, all_sheets=False, allow_cleaned=False):
+    file_data = check_export(file_name, source, all_sheets)
+
+    # read one sheet's question table and category averages, without the confidence intervals the preview
+    # doesn't show
+    def preview_sheet(ws, name):
+        if not allow_cleaned and ws["D23"].value is not None:
+            raise CleaningError(
+                "The uploaded file appears to have been processed already! Please upload a different file.",
+                "already_processed")
+        template, df, summary = analyze_sheet(ws, name, intervals=False)
+        return CleanedSheet(name, ws.title, template, *pack_frame(df), pack_summary(summary))
+
+    with timed("preview"):
+        wb = openpyxl.load_workbook(file_data, read_only=True)
+        try:
+            sheets = process_survey_sheets(wb, file_name, all_sheets, preview_sheet)
+        finally:
+            wb.close()
+            file_data.seek(0)
+
+    return sheets
+
+
+# Define helper function to pack the cleaned files (bytes, memoryviews or BytesIO) into one ZIP file,
+# compressing them in parallel at the configured level (see bundling.py). The list is emptied and each
+# BytesIO closed as its content is handed over.
+def build_bundle(files_to_download, compression_level=None):
+    members = []
+    while files_to_download:
+        file_name, file_data = files_to_download.pop(0)
+        if isinstance(file_data, io.BytesIO):
+            file_data, buffer = file_data.getvalue(), file_data
+            buffer.close()
+        members.append((file_name, file_data))
+
+    with timed("bundle"):
+        return write_zip(members, compression_level)
@@ -0,0 +1,13 @@
+# Errors raised while reading and cleaning an export, with a message for the user
+
+
+# A ValueError with a message for the user and a short reason code for the failure metrics, e.g.
+# 'already_processed' or 'unknown_template'. Other ValueErrors count as 'invalid_survey'.
+class CleaningError(ValueError):
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+    # keep the reason when the error is pickled, e.g. back from a worker process
+    def __reduce__(self):
+        return CleaningError, (str(self), self.reason)
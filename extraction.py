@@ -0,0 +1,154 @@
+# Vectorized extraction of the question table from a Survey Monkey export
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from errors import CleaningError
+from templates import CATEGORY_1, CATEGORY_2, CATEGORY_3, NOT_APPLICABLE, category_labels
+
+
+# the question number is the run of digits right after the leading 'Q' (e.g. 'Q12 How often...' -> 12)
+QUESTION_NUMBER_PATTERN = r'^\s*Q(\d+)'
+
+# the question table header lives on row 23, so the data starts on row 24
+FIRST_DATA_ROW = 24
+
+
+# Define helper function to tell a survey sheet from any other sheet in the workbook: its question table
+# starts at A24 with a question number. Read-only sheets without a size record report no max_row, so those are
+# checked at A24 directly.
+def is_survey_sheet(ws):
+    if (ws.max_row or FIRST_DATA_ROW) < FIRST_DATA_ROW:
+        return False
+    return re.match(QUESTION_NUMBER_PATTERN, str(ws.cell(row=FIRST_DATA_ROW, column=1).value or "")) is not None
+
+
+# Define helper function to read columns A:C from row 24 down until the first blank cell in column A
+def read_question_table(ws, start_row=FIRST_DATA_ROW):
+    data = []
+    for values in ws.iter_rows(min_row=start_row, max_col=3, values_only=True):
+        if values[0] is None:
+            break
+        data.append(values)
+
+    return pd.DataFrame(data, columns=["Questions", "Difficulty", "Average Score"])
+
+
+# Define helper function to pull the question numbers out of the question text in one pass
+def parse_question_numbers(questions):
+    numbers = questions.astype("string").str.extract(
+        QUESTION_NUMBER_PATTERN, expand=False)
+    return pd.to_numeric(numbers, errors="coerce").astype("Int64")
+
+
+# Define helper function to turn '85%', '85.5 %', 85 or blanks into floats (blanks become NaN)
+def parse_percentages(scores):
+    cleaned = scores.astype("string").str.replace(
+        "%", "", regex=False).str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").astype(float)
+
+
+# Define helper function to check the question numbers. Unreadable or duplicated numbers raise a
+# ValueError; gaps in the sequence are returned so the caller can name them in its error.
+def validate_question_order(numbers):
+    missing = numbers.isna()
+    if missing.any():
+        raise ValueError(
+            f"Could not read a question number for {int(missing.sum())} question(s). Every question should start with 'Q' and its number.")
+
+    duplicated = np.unique(numbers[numbers.duplicated()].to_numpy(dtype=np.int64))
+    if len(duplicated):
+        listed = ", ".join(f"Q{number}" for number in duplicated)
+        raise ValueError(f"Question(s) {listed} appear more than once.")
+
+    ordered = np.sort(numbers.to_numpy(dtype=np.int64))
+    gap_starts = np.flatnonzero(np.diff(ordered) > 1)
+    return [number for start in gap_starts for number in range(ordered[start] + 1, ordered[start + 1])]
+
+
+# Extract the question table into a typed DataFrame sorted by question order. Returns the frame and a
+# list of question numbers that are missing from an otherwise consecutive sequence.
+def extract_survey_frame(ws):
+    df = read_question_table(ws)
+    if df.empty:
+        raise ValueError("No questions were found starting at cell A24.")
+
+    numbers = parse_question_numbers(df["Questions"])
+    gaps = validate_question_order(numbers)
+
+    df["Avg. Score (%)"] = parse_percentages(df["Average Score"])
+    if df["Avg. Score (%)"].isna().all():
+        raise CleaningError(
+            "None of the average scores in column C could be read. Please check that the file has its results.",
+            "no_scores")
+    df["Question Order"] = numbers.astype(np.int64)
+    df = df.drop(columns="Average Score").sort_values(
+        by="Question Order", kind="stable").reset_index(drop=True)
+
+    # Overwrite the "Question Order" column with sequential numbers starting from 1
+    df["Question Order"] = np.arange(1, len(df) + 1)
+
+    return df, gaps
+
+
+# Define helper function to fingerprint a sorted question table as (first question number, last question
+# number, question count). Only the first and last questions are parsed, so this takes constant time.
+def question_signature(df):
+    ends = parse_question_numbers(df["Questions"].iloc[[0, -1]])
+    return int(ends.iloc[0]), int(ends.iloc[-1]), len(df)
+
+
+# Add the 1st-, 2nd- and (for Leader/Team) 3rd-order category columns as categoricals
+def assign_categories(df, template):
+    levels = [('1st', CATEGORY_1), ('2nd', CATEGORY_2)]
+    if template in ('Leader', 'Team'):
+        levels.append(('3rd', CATEGORY_3 + [NOT_APPLICABLE]))
+
+    for level, categories in levels:
+        labels = category_labels(template, level)
+        if len(labels) != len(df):
+            raise ValueError(
+                f"The {template} template expects {len(labels)} questions but the file has {len(df)}.")
+        df[f'{level}-Order Category'] = pd.Categorical(
+            labels, categories=categories)
+
+    # the 'Health' questions are not split between Leader and Team
+    if '3rd-Order Category' in df:
+        df.loc[df['2nd-Order Category'] == 'Health',
+               '3rd-Order Category'] = NOT_APPLICABLE
+
+    return df
+
+
+# the category columns of a question table with their categories, in the order pack_frame stores their codes
+CATEGORY_COLUMNS = [('1st-Order Category', CATEGORY_1), ('2nd-Order Category', CATEGORY_2),
+                    ('3rd-Order Category', CATEGORY_3 + [NOT_APPLICABLE])]
+
+
+# Pack a categorized question table into compact arrays for keeping it around: the question texts and
+# difficulties as tuples, the scores as float32 and the category codes as an int8 array with one column per
+# level (-1 where a question has no category, e.g. every question of a table without a 3rd-order column)
+def pack_frame(df):
+    codes = np.full((len(df), len(CATEGORY_COLUMNS)), -1, dtype=np.int8)
+    for level, (column, _) in enumerate(CATEGORY_COLUMNS):
+        if column in df:
+            codes[:, level] = df[column].cat.codes
+
+    return tuple(df["Questions"]), tuple(df["Difficulty"]), df["Avg. Score (%)"].to_numpy(dtype=np.float32), codes
+
+
+# Rebuild the question table from the arrays of pack_frame. float32 holds the 6 significant digits the
+# exports report scores with, so each score is restored through its shortest decimal form to the same float
+# it was parsed as.
+def unpack_frame(questions, difficulty, scores, codes):
+    df = pd.DataFrame({"Questions": list(questions), "Difficulty": list(difficulty)})
+    df["Avg. Score (%)"] = scores.astype(str).astype(float)
+    df["Question Order"] = np.arange(1, len(df) + 1)
+
+    for level, (column, categories) in enumerate(CATEGORY_COLUMNS):
+        if level < 2 or (codes[:, level] >= 0).any():
+            df[column] = pd.Categorical.from_codes(codes[:, level], categories=categories)
+
+    return df
@@ -0,0 +1,181 @@
+# Load test for the cleaning engine. Simulates N concurrent app sessions, each cleaning a mixed batch of
+# Review / No leader / Leader / Team exports the way main() does (clean every file, compare the Leader-Team
+# pairs, bundle the zip), and reports throughput, latency percentiles, time to the first cleaned file and peak
+# RSS per concurrency level. With --processes, the peak RSS includes the worker processes.
+#
+# Streamlit runs every session in a thread of one server process, so sessions are simulated with threads.
+#
+#   python load_test.py --concurrency 1 2 4 8 --sessions 16 --batch-size 6
+
+import argparse
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from comparison import build_pairs, compare_pairs, default_pairs, write_comparisons
+from engine import build_bundle, question_table
+from pipeline import clean_batch, release
+from synthetic import make_batch
+
+
+# Define helper function to read the current resident set size of a process in bytes (None where /proc is
+# not available or the process is gone)
+def current_rss(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+# Define helper function to list the processes started under this one (the fork server and the worker
+# processes it starts), from the parent pid of every process in /proc
+def descendant_pids():
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # the parent pid is the second field after the command name, which is in parentheses
+                parents[int(entry)] = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+
+    pids = [os.getpid()]
+    for pid in pids:
+        pids.extend(child for child, parent in parents.items() if parent == pid)
+    return pids[1:]
+
+
+# Define helper function to watch the RSS in the background and remember its peak. With workers, the RSS of
+# every process started under this one is added, with the list of processes refreshed every `rescan` seconds.
+# Pages shared between the processes are counted in each of them, so the total is an upper bound.
+def sample_peak_rss(stop, peak, workers=False, interval=0.01, rescan=0.5):
+    pids = []
+    scanned = 0.0
+    while not stop.is_set():
+        if workers and time.monotonic() - scanned > rescan:
+            pids = descendant_pids()
+            scanned = time.monotonic()
+
+        rss = current_rss()
+        if rss is not None:
+            peak[0] = max(peak[0], rss + sum(current_rss(pid) or 0 for pid in pids))
+        stop.wait(interval)
+
+
+# One simulated session: clean the batch (smallest files first, like main() does), compare its Leader-Team
+# pairs and bundle the downloads. With processes, the files are cleaned in that many worker processes and
+# their results packed straight from shared memory. Returns the session latency and the time to the first
+# cleaned file, in seconds.
+def run_session(batch, processes=None):
+    started = time.perf_counter()
+
+    files_to_download = []
+    surveys = []
+    items = []
+    first_result = None
+    for item in clean_batch(batch, shortest_first=True, workers=processes):
+        items.append(item)
+        if first_result is None:
+            first_result = time.perf_counter() - started
+        if item.error is not None:
+            raise item.error
+        if item.duplicate:
+            continue
+        cleaned = item.cleaned
+        surveys.extend((sheet.name, sheet.template, question_table(sheet))
+                       for sheet in cleaned.sheets)
+        files_to_download.append((cleaned.file_name, cleaned.data))
+
+    leader_names = [name for name, template, _ in surveys if template == 'Leader']
+    team_names = [name for name, template, _ in surveys if template == 'Team']
+    pairs = build_pairs(default_pairs(leader_names, team_names))
+    if pairs:
+        files_to_download.extend(write_comparisons(*compare_pairs(surveys, pairs)))
+
+    build_bundle(files_to_download)
+    for item in items:
+        release(item)
+    return time.perf_counter() - started, first_result
+
+
+# Run `sessions` sessions with at most `concurrency` of them at a time and summarize the level
+def run_level(batches, concurrency, processes=None):
+    stop = threading.Event()
+    peak = [current_rss() or 0]
+    sampler = threading.Thread(target=sample_peak_rss, args=(stop, peak, bool(processes)), daemon=True)
+    sampler.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies, first_results = np.array(list(pool.map(partial(run_session, processes=processes), batches))).T
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    sampler.join()
+
+    # without /proc, fall back to the process-wide peak (kilobytes on Linux), plus that of the largest worker
+    # process that has finished
+    peak_rss = peak[0] or (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    n_files = sum(len(batch) for batch in batches)
+    return {
+        "Concurrency": concurrency,
+        "Sessions": len(batches),
+        "Files": n_files,
+        "Throughput (files/s)": n_files / elapsed,
+        "Throughput (sessions/s)": len(batches) / elapsed,
+        "p50 (s)": p50,
+        "p95 (s)": p95,
+        "p99 (s)": p99,
+        "First file p50 (s)": np.percentile(first_results, 50),
+        "Peak RSS (MiB)": peak_rss / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the cleaning engine with concurrent simulated sessions.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="concurrency levels to test")
+    parser.add_argument("--sessions", type=int, default=16,
+                        help="sessions per concurrency level")
+    parser.add_argument("--batch-size", type=int, default=6,
+                        help="files uploaded per session")
+    parser.add_argument("--processes", type=int,
+                        help="clean each session's files in this many worker processes instead of threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="also write the results to this CSV file")
+    args = parser.parse_args(argv)
+
+    # generate the uploads up front so only the cleaning is timed
+    batches = [make_batch(args.batch_size, seed=args.seed + session)
+               for session in range(args.sessions)]
+
+    # warm up imports and caches before the first measured level
+    run_session(batches[0], args.processes)
+
+    results = []
+    for concurrency in args.concurrency:
+        results.append(run_level(batches, concurrency, args.processes))
+        print(f"concurrency {concurrency}: done", file=sys.stderr)
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import streamlit as st
-import pandas as pd
-import io
-import zipfile
-import openpyxl
-from openpyxl.styles import Font, Alignment
-from openpyxl.utils import get_column_letter
-from copy import copy
-import numpy as np
+import sys
+
+from bundling import COMPRESSION_LEVEL
+from comparison import build_pairs, compare_pairs, default_pairs, write_comparisons
+from engine import build_bundle, category_summary, cleaned_name, preview_workbook, question_table
+import metrics
+from pipeline import clean_batch
+from profiling import profile_run
+from rollup import ROLLUP_FILE_NAME, build_rollup, write_rollup
+from summary import wide_tables
+from trend import TREND_FILE_NAME, build_trend, write_trend
 
 
 # set page configurations
@@ -92,15 +95,10 @@ st.markdown(f'''
 ''', unsafe_allow_html=True)
 
 
-# Define helper function to extract the question number from the string for sorting
-def extract_question_number(question):
-    try:
-        return int(question.split()[0][1:])  # Extract the number following 'Q'
-    except ValueError:
-        return None  # If no number is found, return None
-
-
 def main():
+    # expose the processing metrics, if a port is configured (started once per server process)
+    metrics.serve()
+
     # declare variable for uploading files
     uploaded_files = st.file_uploader(
         label="Choose completed reporting template",
@@ -109,1118 +107,216 @@ def main():
         help="Upload Survey Monkey template(s) here."
     )
 
-    if uploaded_files:
+    # optionally bundle a consolidated rollup of every uploaded survey
+    include_rollup = st.checkbox(
+        "Include a consolidated rollup workbook",
+        help="Adds one workbook with the category averages of every survey, per template and across all surveys.")
 
-        # Prepare list to hold file data
-        files_to_download = []
+    # optionally clean every survey sheet of a workbook (e.g. one per team or wave), not just the active one
+    all_sheets = st.checkbox(
+        "Clean every survey sheet in each workbook",
+        help="For exports holding several surveys, one per sheet. Each sheet is cleaned and summarized as its own survey.")
 
-        # capture which templates are uploaded
-        templates_list = []
+    # optionally just look at the averages first, without generating any workbook
+    preview = st.checkbox(
+        "Preview the summaries only",
+        help="Shows the overall and category averages (and the Leader-Team deltas) of every upload right away. Untick to clean the files for download.")
 
-        # Iterate through uploaded files
-        for uploaded_file in uploaded_files:
+    # optionally compare several waves of one survey instead of cleaning them
+    trend = st.checkbox(
+        "Compare waves of one survey (trend)",
+        help="Upload exports (raw or cleaned) of the same template, one per wave, in order from oldest to newest. Creates one trend workbook with the change and slope of every question and category.")
 
-            # check the file extension of the uploaded file. If it's not XLSX, return an error message
-            if uploaded_file.name.split('.')[-1] != 'xlsx':
-                st.error(
-                    "The uploaded file is not in the correct format. Please upload an Excel file.")
-                return
+    if uploaded_files and preview:
+        show_preview(uploaded_files, all_sheets)
 
-            # Read the file into memory
-            file_data = io.BytesIO(uploaded_file.read())
+    elif uploaded_files and trend:
+        show_trend(uploaded_files, all_sheets)
 
-            # Load the workbook using openpyxl
-            wb = openpyxl.load_workbook(file_data)
-            ws = wb.active  # Assuming the data is on the active sheet
+    elif uploaded_files:
 
-            # Iterate over all merged cells and unmerge them
-            for merged_cell_range in list(ws.merged_cells.ranges):
-                ws.unmerge_cells(str(merged_cell_range))
+        # Prepare list to hold file data
+        files_to_download = []
 
-            # check to see if the uploaded file has already been cleaned by seeing if cell D23 is empty. If it is, we're good to go.
-            if ws["D23"].value is not None:
-                st.error(
-                    "The uploaded file appears to have been processed already! Please upload a different file.")
+        # keep the question table of every survey for the rollup
+        surveys = []
+
+        # peak memory per file (MiB), measured in memory-budget mode
+        peak_memory = {}
+
+        # content hash -> (first file name, cleaned file), so identical uploads are only cleaned once
+        cleaned_by_hash = {}
+        duplicates = []
+
+        # (file name, content hash) -> cleaned file of every file cleaned in this session (with these options),
+        # kept across reruns so that pressing a button (which reruns the app) doesn't clean the uploads again
+        session_cache = st.session_state.setdefault("cleaned_files", {}).setdefault(all_sheets, {})
+
+        # with several files, offer each cleaned workbook as soon as it is ready; the bundle with everything
+        # (and the Leader-Team comparisons) follows once the whole batch is done. Downloading one reruns the
+        # app, which then picks up the files cleaned so far from the session cache and goes on with the rest.
+        ready = st.expander("Cleaned files, as they are ready", expanded=True) if len(
+            uploaded_files) > 1 else None
+
+        # (upload position, batch item, cleaned file) of every upload, put back in upload order once all are done
+        finished = []
+
+        # Clean the files straight from the upload buffers, without copying them. Reading, checking, cleaning
+        # and saving run as a pipeline, so the next file is being read while this one is cleaned, and the
+        # smallest files go first so the first results show up quickly. A profiled run cleans them on this
+        # thread instead, where the profiler can see the work.
+        batch = clean_batch([(uploaded_file.name, uploaded_file) for uploaded_file in uploaded_files],
+                            all_sheets=all_sheets, shortest_first=True, sequential=profiling_requested(),
+                            done=session_cache)
+        for item in batch:
+
+            # reuse the result of an identical upload earlier in the batch
+            if item.duplicate:
+                first_name, cleaned = cleaned_by_hash[item.digest]
+                duplicates.append((item.file_name, first_name))
+                finished.append((item.index, item, cleaned))
+                continue
+
+            if item.error is not None:
+                batch.close()
+                if not isinstance(item.error, ValueError):
+                    raise item.error
+                metrics.write_textfile()
+                st.error(f"{item.file_name}: {item.error}")
                 return
-
-            # Add new columns & formatting
-            ws["D23"] = "Question Order"
-            ws["D23"].font = copy(ws["C23"].font)
-            ws["D23"].fill = copy(ws["C23"].fill)
-            ws["D23"].alignment = copy(ws["C23"].alignment)
-
-            ws["E23"] = "1st-Order Category"
-            ws["E23"].font = copy(ws["C23"].font)
-            ws["E23"].fill = copy(ws["C23"].fill)
-            ws["E23"].alignment = copy(ws["C23"].alignment)
-
-            ws["F23"] = "2nd-Order Category"
-            ws["F23"].font = copy(ws["C23"].font)
-            ws["F23"].fill = copy(ws["C23"].fill)
-            ws["F23"].alignment = copy(ws["C23"].alignment)
-
-            # Extract the data starting from A23 down until the first blank cell
-            row = 24
-            data = []
-            while ws[f"A{row}"].value is not None:
-                # Append row data into the list
-                data.append(
-                    [ws[f"A{row}"].value, ws[f"B{row}"].value, ws[f"C{row}"].value])
-                row += 1
-
-            # Create a DataFrame from the extracted data
-            df = pd.DataFrame(
-                data, columns=["Questions", "Difficulty", "Average Score"])
-
-            # Convert the 'Average Score' column to integer
-            df["Average Score"] = df["Average Score"].str.replace(
-                '%', '').astype(int)
-            df = df.rename(columns={"Average Score": "Avg. Score (%)"})
-
-            # convert overall average
-            overall_avg = df["Avg. Score (%)"].mean()
-
-            # Add the "Question Order" column based on the extracted question
-            df["Question Order"] = df["Questions"].apply(
-                extract_question_number).astype(int)
-
-            # Sort the DataFrame by "Question Order"
-            df = df.sort_values(by="Question Order")
-
-            # Overwrite the "Question Order" column with sequential numbers starting from 1
-            df["Question Order"] = range(1, len(df) + 1)
-
-            # 1st-, 2nd-, and 3rd-Order Categories
-            category_1 = ['THRIVE', 'Just Leader']
-            category_2 = [
-                'Trust', 'Health', 'Relationships', 'Impact', 'Value', 'Engagement', 'See the Whole Playing Field', 'Build Cultural Competency', 'Give Power Away', 'Take Bold, Courageous Action']
-
-            # this level will only pertain to the LEADER and TEAM templates
-            category_3 = [
-                'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team', 'Leader', 'Team']
-
-            template = ''
-
-            # fill out templates
-            if df.shape[0] == 38:  # Review template
-
-                template = 'Review'
-                templates_list.append(template)
-
-                # fill in the "Category" column
-                repetitions_1 = [30, 8]
-                category_list_1 = []
-                for category, rep in zip(category_1, repetitions_1):
-                    category_list_1.extend([category] * rep)
-                df['1st-Order Category'] = category_list_1
-                first0_summary = df.groupby(
-                    '1st-Order Category')['Avg. Score (%)'].mean().reset_index()
-
-                # Start from A22 and find the last filled cell in column A
-                current_row = 22
-                while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
-                    current_row += 1  # Move down
-
-                # Move one row below the last filled cell
-                start_row = current_row + 1
-
-                # Insert blank rows after the last row written
-                ws.insert_rows(current_row, 8)
-
-                # Add the overall average
-                ws["A63"] = "Overall Average (%)"
-                ws["B63"] = overall_avg
-
-                # use a custom sort for the summary table
-                first0_summary['1st-Order Category'] = pd.Categorical(
-                    first0_summary['1st-Order Category'], [
-                        "THRIVE", "Just Leader",
-                    ])
-                first0_summary = first0_summary.sort_values(
-                    "1st-Order Category")
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                first0_new = first0_summary.set_index("1st-Order Category").T
-
-                # header column
-                ws["A65"] = "1st-Order Category"
-                ws["A66"] = "Avg. Score (%)"
-
-                # copy in heading labels
-                ws["B65"] = "THRIVE"
-                ws["C65"] = "Just Leader"
-
-                row = 66  # Starting point
-                for _, row_data in first0_new.iterrows():
-                    ws[f"B{row}"] = row_data["THRIVE"]
-                    ws[f"C{row}"] = row_data["Just Leader"]
-                    row += 1  # Move to the next row
-
-                repetitions_2 = [5, 5, 5, 5, 5, 5, 2, 2, 2, 2]
-                category_list_2 = []
-                for category, rep in zip(category_2, repetitions_2):
-                    category_list_2.extend([category] * rep)
-                df['2nd-Order Category'] = category_list_2
-                second0_summary = df.groupby(
-                    ['1st-Order Category', '2nd-Order Category'])['Avg. Score (%)'].mean().reset_index().drop(columns='1st-Order Category')
-
-                # use a custom sort for the summary table
-                second0_summary['2nd-Order Category'] = pd.Categorical(
-                    second0_summary['2nd-Order Category'], [
-                        "Trust", "Health", "Relationships", "Impact", "Value", "Engagement", "See the Whole Playing Field", "Build Cultural Competency", "Give Power Away", "Take Bold, Courageous Action"
-                    ])
-                second0_summary = second0_summary.sort_values(
-                    "2nd-Order Category")
-
-                # header rows
-                ws["A68"] = "2nd-Order Category"
-                ws["A69"] = "Avg. Score (%)"
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                second0_new = second0_summary.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 69  # Starting point
-                for _, row_data in second0_new.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Health"]
-                    ws[f"D{row}"] = row_data["Relationships"]
-                    ws[f"E{row}"] = row_data["Impact"]
-                    ws[f"F{row}"] = row_data["Value"]
-                    ws[f"G{row}"] = row_data["Engagement"]
-                    ws[f"H{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"I{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"J{row}"] = row_data["Give Power Away"]
-                    ws[f"K{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 2nd-Order Category labels
-                ws["B68"] = "Trust"
-                ws["C68"] = "Health"
-                ws["D68"] = "Relationships"
-                ws["E68"] = "Impact"
-                ws["F68"] = "Value"
-                ws["G68"] = "Engagement"
-                ws["H68"] = "See the Whole Playing Field"
-                ws["I68"] = "Build Cultural Competency"
-                ws["J68"] = "Give Power Away"
-                ws["K68"] = "Take Bold, Courageous Action"
-
-                # Format the newly-created cells
-                start_row = 24
-                end_row = 70
-                start_col = 1  # Column A (1-indexed)
-                end_col = 11
-
-                # Define the font style
-                custom_font = Font(name="Arial", size=11)
-
-                # Apply the font style to each cell in the range
-                for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
-                    for cell in row:
-                        cell.font = custom_font
-
-                # format the headers - Overall average
-                ws["A63"].font = Font(name="Arial", size=12, bold=True)
-                ws["B63"].font = Font(name="Arial", size=12, bold=True)
-
-                # First-Order Average
-                ws["A65"].font = Font(name="Arial", size=11, bold=True)
-                ws["A66"].font = Font(name="Arial", size=11, bold=True)
-
-                # Second-Order Average
-                ws["A68"].font = Font(name="Arial", size=11, bold=True)
-                ws["A69"].font = Font(name="Arial", size=11, bold=True)
-
-                # Center alignment
-                ws["A65"].alignment = copy(ws["C23"].alignment)
-                ws["A66"].alignment = copy(ws["C23"].alignment)
-                ws["A68"].alignment = copy(ws["C23"].alignment)
-                ws["A69"].alignment = copy(ws["C23"].alignment)
-
-                # rounding - summary tables
-                for row in ws.iter_rows(min_row=63, max_row=71, min_col=2, max_col=11):
-                    for cell in row:
-                        # Check if cell contains a numeric value
-                        if isinstance(cell.value, (int, float)):
-                            cell.value = round(cell.value, 0)
-
-                            # Round to 1 decimal place
-                            cell.number_format = '0.0'
-
-                # row height
-                for row in range(63, 71):
-                    ws.row_dimensions[row].height = 15
-
-                # get standard deviation values in template
-                std_dev_values = []
-
-                # Start iterating from the first cell in column C
-                column = 3  # Column C
-                row = 1  # Start at the first row
-                max_row = 5000
-
-                # Iterate through column C until the end and collect STD values
-                while row <= max_row:
-                    cell_value = ws.cell(row=row, column=column).value
-
-                    # Check if the cell contains 'Standard Deviation'
-                    if cell_value == "Standard Deviation":
-                        # Get the value in the cell below
-                        next_cell_value = ws.cell(
-                            row=row + 1, column=column).value
-                        # if next_cell_value is not None, append to std_dev_values
-                        if next_cell_value is not None:
-                            std_dev_values.append(next_cell_value)
-
-                        # Move the row pointer down by 2 to skip the value we just processed
-                        row += 2
-                    else:
-                        # Move to the next row
-                        row += 1
-
-            elif df.shape[0] == 47:  # No leader template
-
-                template = 'No leader'
-                templates_list.append(template)
-
-                repetitions_1 = [35, 12]
-                category_list_1 = []
-                for category, rep in zip(category_1, repetitions_1):
-                    category_list_1.extend([category] * rep)
-                df['1st-Order Category'] = category_list_1
-                first0_summary = df.groupby(
-                    '1st-Order Category')['Avg. Score (%)'].mean().reset_index()
-
-                # Start from A22 and find the last filled cell in column A
-                current_row = 22
-                while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
-                    current_row += 1  # Move down
-
-                # Move one row below the last filled cell
-                start_row = current_row + 1
-
-                # Insert 12 blank rows after the last row written
-                ws.insert_rows(current_row, 8)
-
-                # Add the overall average
-                ws["A72"] = "Overall Average (%)"
-                ws["B72"] = overall_avg
-
-                # use a custom sort for the summary table
-                first0_summary['1st-Order Category'] = pd.Categorical(
-                    first0_summary['1st-Order Category'], [
-                        "THRIVE", "Just Leader",
-                    ])
-                first0_summary = first0_summary.sort_values(
-                    "1st-Order Category")
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                first0_new = first0_summary.set_index("1st-Order Category").T
-
-                # header column
-                ws["A74"] = "1st-Order Category"
-                ws["A75"] = "Avg. Score (%)"
-
-                # copy in heading labels
-                ws["B74"] = "THRIVE"
-                ws["C74"] = "Just Leader"
-
-                row = 75  # Starting point
-                for _, row_data in first0_new.iterrows():
-                    ws[f"B{row}"] = row_data["THRIVE"]
-                    ws[f"C{row}"] = row_data["Just Leader"]
-                    row += 1  # Move to the next row
-
-                repetitions_2 = [5, 10, 5, 5, 5, 5, 3, 3, 3, 3]
-                category_list_2 = []
-                for category, rep in zip(category_2, repetitions_2):
-                    category_list_2.extend([category] * rep)
-                df['2nd-Order Category'] = category_list_2
-                second0_summary = df.groupby(
-                    ['1st-Order Category', '2nd-Order Category'])['Avg. Score (%)'].mean().reset_index().drop(columns='1st-Order Category')
-
-                # use a custom sort for the summary table
-                second0_summary['2nd-Order Category'] = pd.Categorical(
-                    second0_summary['2nd-Order Category'], [
-                        "Trust", "Health", "Relationships", "Impact", "Value", "Engagement", "See the Whole Playing Field", "Build Cultural Competency", "Give Power Away", "Take Bold, Courageous Action"
-                    ])
-                second0_summary = second0_summary.sort_values(
-                    "2nd-Order Category")
-
-                # header rows
-                ws["A77"] = "2nd-Order Category"
-                ws["A78"] = "Avg. Score (%)"
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                second0_new = second0_summary.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 78  # Starting point
-                for _, row_data in second0_new.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Health"]
-                    ws[f"D{row}"] = row_data["Relationships"]
-                    ws[f"E{row}"] = row_data["Impact"]
-                    ws[f"F{row}"] = row_data["Value"]
-                    ws[f"G{row}"] = row_data["Engagement"]
-                    ws[f"H{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"I{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"J{row}"] = row_data["Give Power Away"]
-                    ws[f"K{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 2nd-Order Category labels
-                ws["B77"] = "Trust"
-                ws["C77"] = "Health"
-                ws["D77"] = "Relationships"
-                ws["E77"] = "Impact"
-                ws["F77"] = "Value"
-                ws["G77"] = "Engagement"
-                ws["H77"] = "See the Whole Playing Field"
-                ws["I77"] = "Build Cultural Competency"
-                ws["J77"] = "Give Power Away"
-                ws["K77"] = "Take Bold, Courageous Action"
-
-                # Define the range of cells
-                start_row = 24
-                end_row = 79
-                start_col = 1  # Column A (1-indexed)
-                end_col = 11  # Column C (1-indexed)
-
-                # Define the font style
-                custom_font = Font(name="Arial", size=11)
-
-                # Apply the font style to each cell in the range
-                for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
-                    for cell in row:
-                        cell.font = custom_font
-
-                # format the headers - overall average
-                ws["A72"].font = Font(name="Arial", size=12, bold=True)
-                ws["B72"].font = Font(name="Arial", size=12, bold=True)
-
-                # First-Order Average
-                ws["A74"].font = Font(name="Arial", size=11, bold=True)
-                ws["A75"].font = Font(name="Arial", size=11, bold=True)
-
-                # Second-Order Average
-                ws["A77"].font = Font(name="Arial", size=11, bold=True)
-                ws["A78"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A74"].alignment = copy(ws["C23"].alignment)
-                ws["A75"].alignment = copy(ws["C23"].alignment)
-                ws["A77"].alignment = copy(ws["C23"].alignment)
-                ws["A78"].alignment = copy(ws["C23"].alignment)
-
-                # rounding
-                for row in ws.iter_rows(min_row=72, max_row=79, min_col=2, max_col=11):
-                    for cell in row:
-                        # Check if cell contains a numeric value
-                        if isinstance(cell.value, (int, float)):
-                            cell.value = round(cell.value, 0)
-
-                            # Round to 1 decimal place
-                            cell.number_format = '0.0'
-
-                # row height
-                for row in range(71, 79):
-                    ws.row_dimensions[row].height = 15
-
-                # get standard deviation values in template
-                std_dev_values = []
-
-                # Start iterating from the first cell in column C
-                column = 3  # Column C
-                row = 1  # Start at the first row
-                max_row = 5000
-
-                # Iterate through column C until the end
-                while row <= max_row:
-                    cell_value = ws.cell(row=row, column=column).value
-
-                    # Check if the cell contains 'Standard Deviation'
-                    if cell_value == "Standard Deviation":
-                        # Get the value in the cell below
-                        next_cell_value = ws.cell(
-                            row=row + 1, column=column).value
-                        # if next_cell_value is not None, append to std_dev_values as a float
-                        if next_cell_value is not None:
-                            next_cell_value = float(next_cell_value)
-                            std_dev_values.append(next_cell_value)
-
-                        # Move the row pointer down by 2 to skip the value we just processed
-                        row += 2
-                    else:
-                        # Move to the next row
-                        row += 1
-
-            elif str(df["Questions"].iloc[0]).startswith("Q7"):  # Leader template
-
-                template = 'Leader'
-                templates_list.append(template)
-
-                df_leader = df.copy()
-
-                # First level breakdown
-                repetitions_1 = [60, 20]
-                category_list_1 = []
-                for category, rep in zip(category_1, repetitions_1):
-                    category_list_1.extend([category] * rep)
-                df['1st-Order Category'] = category_list_1
-                first0_summary = df.groupby(
-                    '1st-Order Category')['Avg. Score (%)'].mean().reset_index()
-
-                # Start from A22 and find the last filled cell in column A
-                current_row = 22
-                while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
-                    current_row += 1  # Move down
-
-                # Move one row below the last filled cell
-                start_row = current_row + 1
-
-                # Insert 12 blank rows after the last row written
-                ws.insert_rows(current_row, 12)
-
-                # Add the overall average
-                ws["A105"] = "Overall Average"
-                ws["B105"] = int(overall_avg)
-
-                # use a custom sort for the summary table
-                first0_summary['1st-Order Category'] = pd.Categorical(
-                    first0_summary['1st-Order Category'], [
-                        "THRIVE", "Just Leader",
-                    ])
-                first0_summary = first0_summary.sort_values(
-                    "1st-Order Category")
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                first0_new = first0_summary.set_index("1st-Order Category").T
-
-                # header column
-                ws["A107"] = "1st-Order Category"
-                ws["A108"] = "Avg. Score (%)"
-
-                # copy in heading labels
-                ws["B107"] = "THRIVE"
-                ws["C107"] = "Just Leader"
-
-                row = 108  # Starting point
-                for _, row_data in first0_new.iterrows():
-                    ws[f"B{row}"] = row_data["THRIVE"]
-                    ws[f"C{row}"] = row_data["Just Leader"]
-                    row += 1  # Move to the next row
-
-                # Second level breakdown
-                repetitions_2 = [10, 10, 10, 10, 10, 10, 5, 5, 5, 5]
-                category_list_2 = []
-                for category, rep in zip(category_2, repetitions_2):
-                    category_list_2.extend([category] * rep)
-                df['2nd-Order Category'] = category_list_2
-                second0_summary = df.groupby(
-                    ['1st-Order Category', '2nd-Order Category'])['Avg. Score (%)'].mean().reset_index().drop(columns='1st-Order Category')
-
-                # use a custom sort for the summary table
-                second0_summary['2nd-Order Category'] = pd.Categorical(
-                    second0_summary['2nd-Order Category'], [
-                        "Trust", "Health", "Relationships", "Impact", "Value", "Engagement", "See the Whole Playing Field", "Build Cultural Competency", "Give Power Away", "Take Bold, Courageous Action"
-                    ])
-                second0_summary = second0_summary.sort_values(
-                    "2nd-Order Category")
-
-                # header rows
-                ws["A110"] = "2nd-Order Category"
-                ws["A111"] = "Avg. Score (%)"
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                second0_new = second0_summary.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 111  # Starting point
-                for _, row_data in second0_new.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Health"]
-                    ws[f"D{row}"] = row_data["Relationships"]
-                    ws[f"E{row}"] = row_data["Impact"]
-                    ws[f"F{row}"] = row_data["Value"]
-                    ws[f"G{row}"] = row_data["Engagement"]
-                    ws[f"H{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"I{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"J{row}"] = row_data["Give Power Away"]
-                    ws[f"K{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 2nd-Order Category labels
-                ws["B110"] = "Trust"
-                ws["C110"] = "Health"
-                ws["D110"] = "Relationships"
-                ws["E110"] = "Impact"
-                ws["F110"] = "Value"
-                ws["G110"] = "Engagement"
-                ws["H110"] = "See the Whole Playing Field"
-                ws["I110"] = "Build Cultural Competency"
-                ws["J110"] = "Give Power Away"
-                ws["K110"] = "Take Bold, Courageous Action"
-
-                # Third level breakdown
-                repetitions_3 = [5, 5, 5, 5, 5, 5, 5, 5,
-                                 5, 5, 5, 5, 2, 3, 2, 3, 2, 3, 2, 3]
-                category_list_3 = []
-                for category, rep in zip(category_3, repetitions_3):
-                    category_list_3.extend([category] * rep)
-                df['3rd-Order Category'] = category_list_3
-
-                # create 3rd-order contat column
-                third0_summary = df[df['2nd-Order Category'] != 'Health'].groupby(
-                    ['2nd-Order Category', '3rd-Order Category'])['Avg. Score (%)'].mean().reset_index()
-
-                # header rows
-                ws["A113"] = "3rd-Order Category"
-                ws["A114"] = "Leader Avg. Score (%)"
-                ws["A115"] = "Team Avg. Score (%)"
-
-                # Per Uncle David's request, show 3rd-order category averages in wide format instead of long format
-                third0_leader = third0_summary[third0_summary['3rd-Order Category']
-                                               == 'Leader'].drop(columns='3rd-Order Category')
-                third0_leader = third0_leader.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 114  # Starting point
-                for _, row_data in third0_leader.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Relationships"]
-                    ws[f"D{row}"] = row_data["Impact"]
-                    ws[f"E{row}"] = row_data["Value"]
-                    ws[f"F{row}"] = row_data["Engagement"]
-                    ws[f"G{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"H{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"I{row}"] = row_data["Give Power Away"]
-                    ws[f"J{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                third0_team = third0_summary[third0_summary['3rd-Order Category']
-                                             == 'Team'].drop(columns='3rd-Order Category')
-                third0_team = third0_team.set_index("2nd-Order Category").T
-
-                row = 115  # Starting point
-                for _, row_data in third0_team.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Relationships"]
-                    ws[f"D{row}"] = row_data["Impact"]
-                    ws[f"E{row}"] = row_data["Value"]
-                    ws[f"F{row}"] = row_data["Engagement"]
-                    ws[f"G{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"H{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"I{row}"] = row_data["Give Power Away"]
-                    ws[f"J{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 3rd-Order Category labels
-                ws["B113"] = "Trust"
-                ws["C113"] = "Relationships"
-                ws["D113"] = "Impact"
-                ws["E113"] = "Value"
-                ws["F113"] = "Engagement"
-                ws["G113"] = "See the Whole Playing Field"
-                ws["H113"] = "Build Cultural Competency"
-                ws["I113"] = "Give Power Away"
-                ws["J113"] = "Take Bold, Courageous Action"
-
-                # Define the range of cells
-                start_row = 24
-                end_row = 116
-                start_col = 1  # Column A (1-indexed)
-                end_col = 11  # Column C (1-indexed)
-
-                # Define the font style
-                custom_font = Font(name="Arial", size=11)
-
-                # Apply the font style to each cell in the range
-                for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
-                    for cell in row:
-                        cell.font = custom_font
-
-                # format the headers
-                ws["A105"].font = Font(name="Arial", size=12, bold=True)
-                ws["B105"].font = Font(name="Arial", size=12, bold=True)
-
-                ws["A107"].font = Font(name="Arial", size=11, bold=True)
-                ws["A108"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A110"].font = Font(name="Arial", size=11, bold=True)
-                ws["A111"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A113"].font = Font(name="Arial", size=11, bold=True)
-                ws["A114"].font = Font(name="Arial", size=11, bold=True)
-                ws["A115"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A107"].alignment = copy(ws["C23"].alignment)
-                ws["A108"].alignment = copy(ws["C23"].alignment)
-
-                ws["A110"].alignment = copy(ws["C23"].alignment)
-                ws["A111"].alignment = copy(ws["C23"].alignment)
-                ws["A113"].alignment = copy(ws["C23"].alignment)
-                ws["A114"].alignment = copy(ws["C23"].alignment)
-                ws["A115"].alignment = copy(ws["C23"].alignment)
-
-                # rounding
-                for row in ws.iter_rows(min_row=105, max_row=116, min_col=2, max_col=11):
-                    for cell in row:
-                        # Check if cell contains a numeric value
-                        if isinstance(cell.value, (int, float)):
-                            cell.value = round(cell.value, 0)
-
-                            cell.number_format = '0'
-
-                # row height
-                for row in range(104, 116):
-                    ws.row_dimensions[row].height = 15
-
-            else:  # Team template
-
-                template = 'Team'
-                templates_list.append(template)
-                df_team = df.copy()
-
-                # First level breakdown
-                repetitions_1 = [60, 20]
-                category_list_1 = []
-                for category, rep in zip(category_1, repetitions_1):
-                    category_list_1.extend([category] * rep)
-                df['1st-Order Category'] = category_list_1
-                first0_summary = df.groupby(
-                    '1st-Order Category')['Avg. Score (%)'].mean().reset_index()
-
-                # Start from A22 and find the last filled cell in column A
-                current_row = 22
-                while ws[f"A{current_row}"].value is not None:  # Check if cell is filled
-                    current_row += 1  # Move down
-
-                # Move one row below the last filled cell
-                start_row = current_row + 1
-
-                # Insert blank rows after the last row written
-                ws.insert_rows(current_row, 12)
-
-                # Add the overall average
-                ws["A105"] = "Overall Average"
-                ws["B105"] = overall_avg
-
-                # use a custom sort for the summary table
-                first0_summary['1st-Order Category'] = pd.Categorical(
-                    first0_summary['1st-Order Category'], [
-                        "THRIVE", "Just Leader",
-                    ])
-                first0_summary = first0_summary.sort_values(
-                    "1st-Order Category")
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                first0_new = first0_summary.set_index("1st-Order Category").T
-
-                # header column
-                ws["A107"] = "1st-Order Category"
-                ws["A108"] = "Avg. Score (%)"
-
-                # copy in heading labels
-                ws["B107"] = "THRIVE"
-                ws["C107"] = "Just Leader"
-
-                row = 108  # Starting point
-                for _, row_data in first0_new.iterrows():
-                    ws[f"B{row}"] = row_data["THRIVE"]
-                    ws[f"C{row}"] = row_data["Just Leader"]
-                    row += 1  # Move to the next row
-
-                # Second level breakdown
-                repetitions_2 = [10, 10, 10, 10, 10, 10, 5, 5, 5, 5]
-                category_list_2 = []
-                for category, rep in zip(category_2, repetitions_2):
-                    category_list_2.extend([category] * rep)
-                df['2nd-Order Category'] = category_list_2
-                second0_summary = df.groupby(
-                    ['1st-Order Category', '2nd-Order Category'])['Avg. Score (%)'].mean().reset_index().drop(columns='1st-Order Category')
-
-                # use a custom sort for the summary table
-                second0_summary['2nd-Order Category'] = pd.Categorical(
-                    second0_summary['2nd-Order Category'], [
-                        "Trust", "Health", "Relationships", "Impact", "Value", "Engagement", "See the Whole Playing Field", "Build Cultural Competency", "Give Power Away", "Take Bold, Courageous Action"
-                    ])
-                second0_summary = second0_summary.sort_values(
-                    "2nd-Order Category")
-
-                # header rows
-                ws["A110"] = "2nd-Order Category"
-                ws["A111"] = "Avg. Score (%)"
-
-                # Per Uncle David's request, show 2nd-order category averages in wide format instead of long format
-                second0_new = second0_summary.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 111  # Starting point
-                for _, row_data in second0_new.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Health"]
-                    ws[f"D{row}"] = row_data["Relationships"]
-                    ws[f"E{row}"] = row_data["Impact"]
-                    ws[f"F{row}"] = row_data["Value"]
-                    ws[f"G{row}"] = row_data["Engagement"]
-                    ws[f"H{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"I{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"J{row}"] = row_data["Give Power Away"]
-                    ws[f"K{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 2nd-Order Category labels
-                ws["B110"] = "Trust"
-                ws["C110"] = "Health"
-                ws["D110"] = "Relationships"
-                ws["E110"] = "Impact"
-                ws["F110"] = "Value"
-                ws["G110"] = "Engagement"
-                ws["H110"] = "See the Whole Playing Field"
-                ws["I110"] = "Build Cultural Competency"
-                ws["J110"] = "Give Power Away"
-                ws["K110"] = "Take Bold, Courageous Action"
-
-                # Third level breakdown
-                repetitions_3 = [5, 5, 5, 5, 5, 5, 5, 5,
-                                 5, 5, 5, 5, 2, 3, 2, 3, 2, 3, 2, 3]
-                category_list_3 = []
-                for category, rep in zip(category_3, repetitions_3):
-                    category_list_3.extend([category] * rep)
-                df['3rd-Order Category'] = category_list_3
-
-                # create 3rd-order contat column
-                third0_summary = df[df['2nd-Order Category'] != 'Health'].groupby(
-                    ['2nd-Order Category', '3rd-Order Category'])['Avg. Score (%)'].mean().reset_index()
-
-                # header rows
-                ws["A113"] = "3rd-Order Category"
-                ws["A114"] = "Leader Avg. Score (%)"
-                ws["A115"] = "Team Avg. Score (%)"
-
-                # Per Uncle David's request, show 3rd-order category averages in wide format instead of long format
-                third0_leader = third0_summary[third0_summary['3rd-Order Category']
-                                               == 'Leader'].drop(columns='3rd-Order Category')
-                third0_leader = third0_leader.set_index("2nd-Order Category").T
-
-                # New code for wide format
-                row = 114  # Starting point
-                for _, row_data in third0_leader.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Relationships"]
-                    ws[f"D{row}"] = row_data["Impact"]
-                    ws[f"E{row}"] = row_data["Value"]
-                    ws[f"F{row}"] = row_data["Engagement"]
-                    ws[f"G{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"H{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"I{row}"] = row_data["Give Power Away"]
-                    ws[f"J{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                third0_team = third0_summary[third0_summary['3rd-Order Category']
-                                             == 'Team'].drop(columns='3rd-Order Category')
-                third0_team = third0_team.set_index("2nd-Order Category").T
-
-                row = 115  # Starting point
-                for _, row_data in third0_team.iterrows():
-                    ws[f"B{row}"] = row_data["Trust"]
-                    ws[f"C{row}"] = row_data["Relationships"]
-                    ws[f"D{row}"] = row_data["Impact"]
-                    ws[f"E{row}"] = row_data["Value"]
-                    ws[f"F{row}"] = row_data["Engagement"]
-                    ws[f"G{row}"] = row_data["See the Whole Playing Field"]
-                    ws[f"H{row}"] = row_data["Build Cultural Competency"]
-                    ws[f"I{row}"] = row_data["Give Power Away"]
-                    ws[f"J{row}"] = row_data["Take Bold, Courageous Action"]
-                    row += 1
-
-                # Copy in 3rd-Order Category labels
-                ws["B113"] = "Trust"
-                ws["C113"] = "Relationships"
-                ws["D113"] = "Impact"
-                ws["E113"] = "Value"
-                ws["F113"] = "Engagement"
-                ws["G113"] = "See the Whole Playing Field"
-                ws["H113"] = "Build Cultural Competency"
-                ws["I113"] = "Give Power Away"
-                ws["J113"] = "Take Bold, Courageous Action"
-
-                # Define the range of cells
-                start_row = 24
-                end_row = 116
-                start_col = 1  # Column A (1-indexed)
-                end_col = 11  # Column C (1-indexed)
-
-                # Define the font style
-                custom_font = Font(name="Arial", size=11)
-
-                # Apply the font style to each cell in the range
-                for row in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=start_col, max_col=end_col):
-                    for cell in row:
-                        cell.font = custom_font
-
-                # format the headers
-                ws["A105"].font = Font(name="Arial", size=12, bold=True)
-                ws["B105"].font = Font(name="Arial", size=12, bold=True)
-
-                ws["A107"].font = Font(name="Arial", size=11, bold=True)
-                ws["A108"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A110"].font = Font(name="Arial", size=11, bold=True)
-                ws["A111"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A113"].font = Font(name="Arial", size=11, bold=True)
-                ws["A114"].font = Font(name="Arial", size=11, bold=True)
-                ws["A115"].font = Font(name="Arial", size=11, bold=True)
-
-                ws["A107"].alignment = copy(ws["C23"].alignment)
-                ws["A108"].alignment = copy(ws["C23"].alignment)
-
-                ws["A110"].alignment = copy(ws["C23"].alignment)
-                ws["A111"].alignment = copy(ws["C23"].alignment)
-                ws["A113"].alignment = copy(ws["C23"].alignment)
-                ws["A114"].alignment = copy(ws["C23"].alignment)
-                ws["A115"].alignment = copy(ws["C23"].alignment)
-
-                # rounding
-                for row in ws.iter_rows(min_row=105, max_row=117, min_col=2, max_col=12):
-                    for cell in row:
-                        # Check if cell contains a numeric value
-                        if isinstance(cell.value, (int, float)):
-                            cell.value = round(cell.value, 0)
-
-                            # Round to 1 decimal place
-                            cell.number_format = '0'
-
-                # row height
-                for row in range(104, 116):
-                    ws.row_dimensions[row].height = 15
-
-                # get standard deviation values in template
-                std_dev_values = []
-
-                # Start iterating from the first cell in column C
-                column = 3  # Column C
-                row = 1  # Start at the first row
-                max_row = 5000
-
-                # Iterate through column C until the end
-                while row <= max_row:
-                    cell_value = ws.cell(row=row, column=column).value
-
-                    # Check if the cell contains 'Standard Deviation'
-                    if cell_value == "Standard Deviation":
-                        # Get the value in the cell below
-                        next_cell_value = ws.cell(
-                            row=row + 1, column=column).value
-                        # if next_cell_value is not None, append to std_dev_values as a float
-                        if next_cell_value is not None:
-                            next_cell_value = float(next_cell_value)
-                            std_dev_values.append(next_cell_value)
-
-                        # Move the row pointer down by 2 to skip the value we just processed
-                        row += 2
-                    else:
-                        # Move to the next row
-                        row += 1
-
-            # For the Leader and Team templates, there will be a 3rd order category
-            if template == 'Leader' or template == 'Team':
-
-                # label Column G, which won't be necessary for the other 2 templates
-                ws["G23"] = "3rd-Order Category"
-                ws["G23"].font = copy(ws["C23"].font)
-                ws["G23"].fill = copy(ws["C23"].fill)
-                ws["G23"].alignment = copy(ws["C23"].alignment)
-
-                # remove 3rd-order category when 2nd-order == 'Health'
-                df["3rd-Order Category"] = np.where(
-                    df["2nd-Order Category"] == 'Health', 'n/a', df["3rd-Order Category"])
-
-                row = 24  # Starting from row 24
-                for idx, row_data in df.iterrows():
-                    ws[f"A{row}"] = row_data["Questions"]
-                    ws[f"B{row}"] = row_data["Difficulty"]
-                    ws[f"C{row}"] = row_data["Avg. Score (%)"]
-                    ws[f"D{row}"] = row_data["Question Order"]
-                    ws[f"E{row}"] = row_data["1st-Order Category"]
-                    ws[f"F{row}"] = row_data["2nd-Order Category"]
-                    ws[f"G{row}"] = row_data["3rd-Order Category"]
-                    row += 1  # Move to the next row
-                ws.column_dimensions['G'].width = 18
-
-            # remove 3rd-order category for the 'Leader' template
-            if template == 'Leader':
-                ws.delete_rows(113, 4)
-
-            if template == 'Team':
-                start_col, end_col = 3, 10
-
-                # Loop backward through columns to shift values right
-                for col in range(end_col, start_col - 1, -1):  # From J to C
-                    for row in range(113, 116):  # Rows 113 to 115
-                        ws.cell(row=row, column=col + 1,
-                                value=ws.cell(row=row, column=col).value)
-                        # Clear old cell
-                        ws.cell(row=row, column=col, value=None)
-
-                # now insert 'Health' into column C
-                ws["C113"] = "Health"
-                ws["C114"] = "N/A"
-                ws["C115"] = "N/A"
-
-                # now right-align cells C114 and C115
-                ws["C114"].alignment = Alignment(horizontal="right")
-                ws["C115"].alignment = Alignment(horizontal="right")
-
-                # re-do the rounding
-                for row in ws.iter_rows(min_row=105, max_row=117, min_col=2, max_col=15):
-                    for cell in row:
-                        # Check if cell contains a numeric value
-                        if isinstance(cell.value, (int, float)):
-                            # round to the nearest whole number
-                            cell.value = round(cell.value, 0)
-
-                            # set the format to integer
-                            cell.number_format = '0'
-
-            # For the Review and No Leader templates, there will be no 3rd order category
-            else:
-                row = 24  # Starting from row 24
-                for idx, row_data in df.iterrows():
-                    ws[f"A{row}"] = row_data["Questions"]
-                    ws[f"B{row}"] = row_data["Difficulty"]
-                    ws[f"C{row}"] = row_data["Avg. Score (%)"]
-                    ws[f"D{row}"] = row_data["Question Order"]
-                    ws[f"E{row}"] = row_data["1st-Order Category"]
-                    ws[f"F{row}"] = row_data["2nd-Order Category"]
-                    row += 1  # Move to the next row
-
-            # for only the Team, Review, and No Leader templates, shift data over to make room for the standard deviation values
-            if template != 'Leader':
-                # Find the data range starting from D23
-                start_row = 23
-                start_col = 4  # Column D
-
-                # Find the last row in column D (stop when an empty cell is encountered)
-                end_row = start_row
-                while ws.cell(row=end_row, column=start_col).value is not None:
-                    end_row += 1
-                end_row -= 1  # Adjust to the last filled row
-
-                # Find the last column (stop when an empty cell is encountered in the header row)
-                end_col = start_col
-                while ws.cell(row=start_row, column=end_col).value is not None:
-                    end_col += 1
-                end_col -= 1  # Adjust to the last filled column
-
-                # Shift data one column to the right
-                for row in range(start_row, end_row + 1):
-                    # Move backward to avoid overwriting
-                    for col in range(end_col, start_col - 1, -1):
-                        source_cell = ws.cell(row=row, column=col)
-                        target_cell = ws.cell(row=row, column=col + 1)
-
-                        # Copy value
-                        target_cell.value = source_cell.value
-
-                        # Copy style if present
-                        if source_cell.has_style:
-                            target_cell._style = source_cell._style
-
-                        # Clear the original cell
-                        source_cell.value = None
-
-                # Now input the standard deviation values
-                ws["D23"] = "Standard deviation"
-                start_row = 24
-                start_column = 4  # Column D
-
-                # Write the values from the list into column D, starting at D24
-                for i, value in enumerate(std_dev_values):
-                    cell = ws.cell(row=start_row + i, column=start_column)
-                    cell.value = float(value)
-
-            # any final adjustments to the table
-            ws["C23"] = "Avg. Score (%)"
-            ws.column_dimensions['A'].width = 50
-            ws.column_dimensions['B'].width = 14
-            ws.column_dimensions['C'].width = 17
-            ws.column_dimensions['D'].width = 17
-            ws.column_dimensions['E'].width = 14
-            ws.column_dimensions['F'].width = 19
-            ws.column_dimensions['G'].width = 19
-            ws.column_dimensions['H'].width = 23
-            ws.column_dimensions['I'].width = 22
-            ws.column_dimensions['J'].width = 15
-            ws.column_dimensions['K'].width = 21
-
-            # Add "_clean" suffix to the file name before the extension
-            clean_file_name = f"{uploaded_file.name.rsplit('.', 1)[0]}_clean.xlsx"
-
-            # Save the modified workbook to a BytesIO object
-            cleaned_file = io.BytesIO()
-            wb.save(cleaned_file)
-            cleaned_file.seek(0)
+            cleaned = item.cleaned
+            cleaned_by_hash[item.digest] = (item.file_name, cleaned)
+            session_cache[item.file_name, item.digest] = cleaned
+            finished.append((item.index, item, cleaned))
+
+            if ready is not None:
+                ready.download_button(
+                    label=cleaned.file_name,
+                    data=cleaned.data,
+                    file_name=cleaned.file_name,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"ready_{item.index}"
+                )
+
+        # forget the files of earlier uploads that have been removed since, so the cache doesn't keep growing
+        uploaded = {(item.file_name, item.digest) for _, item, _ in finished if not item.duplicate}
+        for cache in st.session_state["cleaned_files"].values():
+            for key in set(cache) - uploaded:
+                del cache[key]
+
+        for _, item, cleaned in sorted(finished, key=lambda entry: entry[0]):
+
+            # the same file dropped in twice only needs to be downloaded once
+            if item.duplicate:
+                output_name = cleaned_name(item.file_name)
+                if all(output_name != file_name for file_name, _ in files_to_download):
+                    files_to_download.append((output_name, cleaned.data))
+                continue
+
+            if cleaned.peak_memory is not None:
+                peak_memory[item.file_name] = cleaned.peak_memory / 2**20
+
+            surveys.extend((sheet.name, sheet.template, question_table(sheet))
+                           for sheet in cleaned.sheets)
 
             # Store the new name and file data
-            files_to_download.append((clean_file_name, cleaned_file))
-
-        # If applicable, create the comparison dataframe between Team and Leader
-        if 'Leader' in templates_list and 'Team' in templates_list:
-            # create the comparison dataframe
-            df_comparison = pd.merge(
-                df_leader, df_team, on="Question Order", suffixes=("_Leader", "_Team")).drop(columns=["Difficulty_Leader", "Difficulty_Team"])
-            df_comparison = df_comparison.rename(
-                columns={"Avg. Score (%)_Leader": "Score_Leader", "Avg. Score (%)_Team": "Score_Team"})
-            df_comparison = df_comparison[[
-                'Question Order', 'Questions_Leader', 'Score_Leader', 'Questions_Team', 'Score_Team']]
-            df_comparison['Score_delta'] = df_comparison['Score_Leader'] - \
-                df_comparison['Score_Team']
-            df_comparison = df_comparison.sort_values(
-                by="Score_delta", ascending=False)
-
-            df_comparison_name = "Leader-Team_Comparison.xlsx"
-
-            # Save the dataframe to a BytesIO object in Excel format
-            comparison_file = io.BytesIO()
-            with pd.ExcelWriter(comparison_file, engine='openpyxl') as writer:
-                df_comparison.to_excel(
-                    writer, index=False, sheet_name='Comparison')
-
-                # Access the worksheet to set column widths
-                worksheet = writer.sheets['Comparison']  # Get the worksheet
-                worksheet.column_dimensions['A'].width = 13
-                worksheet.column_dimensions['B'].width = 75
-                worksheet.column_dimensions['C'].width = 13
-                worksheet.column_dimensions['D'].width = 75
-                worksheet.column_dimensions['E'].width = 13
-                worksheet.column_dimensions['F'].width = 13
-
-            # Move to the beginning of the BytesIO buffer
-            comparison_file.seek(0)
-
-            # Append the file to the files_to_download list
-            files_to_download.append((df_comparison_name, comparison_file))
-            st.markdown(f'''
-                <p style="font-size: 18px; font-weight: 100; text-align: center; margin-top: 0px; margin-bottom: 40px; color: #fefefe;">
-                    <i><b>Note:</b> You have uploaded a Leader and a Team template. You will find a comparison file with the zipped bundle in your Downloads folder when you press the button below.</i>
-                </p>
-            ''', unsafe_allow_html=True)
+            files_to_download.append((cleaned.file_name, cleaned.data))
+
+        # refresh the metrics file (if configured) once the batch is cleaned
+        metrics.write_textfile()
+
+        if duplicates:
+            listed = "; ".join(
+                f"{name} (uploaded twice)" if name == first_name else f"{name} (same as {first_name})"
+                for name, first_name in duplicates)
+            st.info(
+                f"Some uploads are identical, so each was only cleaned once: {listed}.")
+
+        if peak_memory:
+            with st.expander("Peak memory per file"):
+                st.dataframe({"File": list(peak_memory), "Peak Memory (MiB)": list(peak_memory.values())},
+                             hide_index=True)
+
+        # If applicable, pair up the Leader and Team files for their comparison files
+        pairs = []
+        leader_names = [name for name, template, _ in surveys if template == 'Leader']
+        team_names = [name for name, template, _ in surveys if template == 'Team']
+        if leader_names and team_names:
+            mapping = default_pairs(leader_names, team_names)
+
+            # with several Leader or Team files, let the user confirm or fix the pairing
+            if len(leader_names) > 1 or len(team_names) > 1:
+                with st.expander("Leader-Team pairing"):
+                    for leader_name in leader_names:
+                        options = [None] + team_names
+                        mapping[leader_name] = st.selectbox(
+                            f"Team file for {leader_name}",
+                            options=options,
+                            index=options.index(mapping[leader_name]),
+                            format_func=lambda name: "(no comparison)" if name is None else name,
+                            key=f"pair_{leader_name}")
+
+            pairs = build_pairs(mapping)
+            if pairs:
+                if len(pairs) == 1:
+                    note = "You have uploaded a Leader and a Team template. You will find a comparison file"
+                else:
+                    note = f"You have uploaded {len(pairs)} Leader-Team pairs. You will find a comparison file for each pair"
+                st.markdown(f'''
+                    <p style="font-size: 18px; font-weight: 100; text-align: center; margin-top: 0px; margin-bottom: 40px; color: #fefefe;">
+                        <i><b>Note:</b> {note} with the zipped bundle in your Downloads folder when you press the button below.</i>
+                    </p>
+                ''', unsafe_allow_html=True)
+
+            unpaired = [leader_name for leader_name, team_name in mapping.items() if team_name is None] + \
+                [team_name for team_name in team_names if team_name not in mapping.values()]
+            if unpaired:
+                st.warning(
+                    f"No Leader-Team comparison was created for: {', '.join(unpaired)}.")
+
+        # the comparison and rollup workbooks (and the ZIP file, once it is asked for) are kept for as long as the
+        # inputs stay the same, so the reruns of pressing the buttons below don't write them again
+        bundle_key = (tuple(uploaded_file.file_id for uploaded_file in uploaded_files),
+                      include_rollup, all_sheets, tuple(pairs))
+        bundle = st.session_state.get("bundle")
+        if bundle is None or bundle[0] != bundle_key:
+            generated_files = []
+
+            # If applicable, create the comparison files of the Leader-Team pairs
+            if pairs:
+                df_comparison, df_category_comparison = compare_pairs(
+                    surveys, pairs)
+                generated_files.extend(write_comparisons(
+                    df_comparison, df_category_comparison))
+
+            # If requested, add the consolidated rollup of every survey to the bundle
+            if include_rollup:
+                generated_files.append(
+                    (ROLLUP_FILE_NAME, write_rollup(build_rollup(surveys))))
+
+            bundle = (bundle_key, [(file_name, file_data.getvalue())
+                                   for file_name, file_data in generated_files], None)
+            st.session_state["bundle"] = bundle
+
+        # Append the files to the files_to_download list
+        files_to_download.extend(bundle[1])
 
         # Handle downloading the files
         if len(files_to_download) > 1:  # Create a ZIP file for multiple uploads
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-                for file_name, file_data in files_to_download:
-                    zip_file.writestr(file_name, file_data.getvalue())
-            zip_buffer.seek(0)
+
+            # the ZIP file is only built once it is asked for
+            if bundle[2] is None:
+                if not st.button(
+                        "Bundle Cleaned Files",
+                        help=f"Zips the files up at compression level {COMPRESSION_LEVEL}, set by CLEANING_APP_BUNDLE_COMPRESSION. The default is 6; 0 stores them uncompressed, as bundles used to be."):
+                    return
+                bundle = (bundle_key, bundle[1], build_bundle(list(files_to_download)))
+                st.session_state["bundle"] = bundle
 
             # Provide download button for the ZIP file
             st.download_button(
                 label=f"Clean & Download Files",
-                data=zip_buffer,
+                data=bundle[2],
                 file_name="uploaded_files_clean.zip",
                 mime="application/zip"
             )
@@ -1235,6 +331,114 @@ def main():
             )
 
 
+# Define helper function to show the overall average and category averages of every upload, and the category
+# deltas of its Leader-Team pairs, from the summaries alone (no workbook is cleaned or saved)
+def show_preview(uploaded_files, all_sheets):
+    surveys = []
+    for uploaded_file in uploaded_files:
+        try:
+            sheets = preview_workbook(
+                uploaded_file.name, uploaded_file, all_sheets=all_sheets)
+        except ValueError as error:
+            st.error(f"{uploaded_file.name}: {error}")
+            return
+
+        for sheet in sheets:
+            df = question_table(sheet)
+            surveys.append((sheet.name, sheet.template, df))
+
+            with st.expander(f"{sheet.name} ({sheet.template})", expanded=len(uploaded_files) == 1):
+                st.metric("Overall Average (%)", f"{df['Avg. Score (%)'].mean():.1f}")
+                for level, table in wide_tables(category_summary(sheet), decimals=1).items():
+                    st.markdown(f"**{level}-Order Category**")
+                    st.dataframe(table)
+
+    leader_names = [name for name, template, _ in surveys if template == 'Leader']
+    team_names = [name for name, template, _ in surveys if template == 'Team']
+    if leader_names and team_names:
+        pairs = build_pairs(default_pairs(leader_names, team_names))
+        if pairs:
+            _, categories = compare_pairs(surveys, pairs)
+            st.markdown("**Leader-Team category deltas** (Leader minus Team)")
+            st.dataframe(categories.round(1), hide_index=True)
+
+
+# Define helper function to build the trend workbook of the uploaded waves, show its category trend and offer
+# it for download
+def show_trend(uploaded_files, all_sheets):
+    surveys = []
+    for uploaded_file in uploaded_files:
+        try:
+            sheets = preview_workbook(
+                uploaded_file.name, uploaded_file, all_sheets=all_sheets, allow_cleaned=True)
+        except ValueError as error:
+            st.error(f"{uploaded_file.name}: {error}")
+            return
+        surveys.extend((sheet.name, sheet.template, question_table(sheet))
+                       for sheet in sheets)
+
+    try:
+        trend_sheets = build_trend(surveys)
+    except ValueError as error:
+        st.error(str(error))
+        return
+
+    st.dataframe(trend_sheets['Categories'], hide_index=True)
+    st.download_button(
+        label="Download Trend Workbook",
+        data=write_trend(trend_sheets),
+        file_name=TREND_FILE_NAME,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+
+# Define helper function to check whether profiling was asked for, either with the ?profile=1 query parameter
+# or by starting the app with `streamlit run main.py -- --profile`
+def profiling_requested():
+    return "--profile" in sys.argv[1:] or st.query_params.get("profile", "").lower() in ("1", "true", "yes")
+
+
+# Define helper function to show the profiling results of a run and offer them as downloads
+def show_profile_report(report):
+    with st.expander("Profiling report", expanded=True):
+        st.markdown(
+            f"Run time: **{report['total_time']:.2f} s** — peak traced memory: **{report['peak_memory'] / 2**20:.1f} MiB**")
+
+        st.markdown("**Hot functions** (by own time)")
+        st.dataframe(report["hot_functions"], hide_index=True)
+        st.download_button(
+            label="Download Hot Functions",
+            data=report["hot_functions"].to_csv(index=False),
+            file_name="hot_functions.csv",
+            mime="text/csv"
+        )
+
+        if report["allocations_at"] == "peak":
+            st.markdown("**Top allocation sites** (while the largest cleaned workbook was open)")
+        else:
+            st.markdown("**Top allocation sites** (allocations retained at the end of the run)")
+        st.dataframe(report["allocations"], hide_index=True)
+        st.download_button(
+            label="Download Allocation Sites",
+            data=report["allocations"].to_csv(index=False),
+            file_name="allocation_sites.csv",
+            mime="text/csv"
+        )
+
+        # the raw dump can be opened with pstats.Stats or tools like snakeviz
+        st.download_button(
+            label="Download pstats Dump",
+            data=report["pstats"],
+            file_name="cleaning.pstats",
+            mime="application/octet-stream"
+        )
+
+
 # Run the app
 if __name__ == "__main__":
-    main()
+    if profiling_requested():
+        with profile_run() as profile_report:
+            main()
+        show_profile_report(profile_report)
+    else:
+        main()
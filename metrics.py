@@ -0,0 +1,219 @@
+# Process-wide metrics registry for operational monitoring: counters, gauges and histograms updated by the
+# cleaning pipeline, rendered in the Prometheus text format. They can be written to a file for the node
+# exporter's textfile collector or served on a local /metrics endpoint.
+#
+#   CLEANING_APP_METRICS_FILE=/var/lib/node_exporter/cleaning_app.prom   (rewritten after every batch)
+#   CLEANING_APP_METRICS_PORT=9464                                        (serves http://127.0.0.1:9464/metrics)
+#   CLEANING_APP_METRICS_HOST=0.0.0.0                                     (listen on every interface instead)
+#
+# Updates are a dict update under a lock, so the cost per file is negligible.
+
+import bisect
+import os
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_FILE = os.environ.get("CLEANING_APP_METRICS_FILE", "")
+METRICS_PORT = int(os.environ.get("CLEANING_APP_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("CLEANING_APP_METRICS_HOST", "127.0.0.1")
+
+# histogram bucket upper bounds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (2**14, 2**16, 2**18, 2**20, 2**22, 2**24, 2**26)
+
+# name -> (type, help text, histogram buckets)
+METRICS = {
+    "cleaning_files_processed_total": (
+        "counter", "Files cleaned successfully.", None),
+    "cleaning_failures_total": (
+        "counter", "Files that could not be cleaned, by reason.", None),
+    "cleaning_input_bytes_total": (
+        "counter", "Bytes of raw exports read.", None),
+    "cleaning_output_bytes_total": (
+        "counter", "Bytes of cleaned workbooks written.", None),
+    "cleaning_stage_duration_seconds": (
+        "histogram", "Time spent in each stage of cleaning one file.", DURATION_BUCKETS),
+    "cleaning_input_size_bytes": (
+        "histogram", "Size of the raw exports.", SIZE_BUCKETS),
+    "cleaning_queue_depth": (
+        "gauge", "Files waiting to be cleaned or being cleaned.", None),
+}
+
+_lock = threading.Lock()
+
+# (name, labels) -> value, where labels is a sorted tuple of (label, value) pairs. Histogram values are
+# [per-bucket counts (the last one is +Inf), sum, count].
+_values = {}
+
+
+# Define helper function to turn keyword labels into the hashable key used by the registry
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# Add to a counter
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+# Set a gauge
+def set_gauge(name, value, **labels):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+# Record one observation in a histogram
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    key = _key(name, labels)
+    with _lock:
+        histogram = _values.get(key)
+        if histogram is None:
+            histogram = _values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+# Time the block and record it as one stage of cleaning a file
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("cleaning_stage_duration_seconds",
+                time.perf_counter() - started, stage=stage)
+
+
+# Take the counters and histograms recorded so far and reset them, e.g. to hand a worker process's metrics
+# to the parent (see merge). Gauges are left alone, since they describe the process that set them.
+def collect():
+    with _lock:
+        collected = {key: value for key, value in _values.items()
+                     if METRICS[key[0]][0] != "gauge"}
+        for key in collected:
+            del _values[key]
+    return collected
+
+
+# Add metrics collected in another process to this registry
+def merge(collected):
+    with _lock:
+        for key, value in collected.items():
+            if METRICS[key[0]][0] == "counter":
+                _values[key] = _values.get(key, 0) + value
+                continue
+
+            histogram = _values.setdefault(
+                key, [[0] * len(value[0]), 0.0, 0])
+            histogram[0] = [mine + theirs for mine,
+                            theirs in zip(histogram[0], value[0])]
+            histogram[1] += value[1]
+            histogram[2] += value[2]
+
+
+# Define helper function to format a label set, optionally with an extra label such as a histogram bucket
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace(
+        '"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+
+# Render every metric in the Prometheus text exposition format
+def render():
+    with _lock:
+        values = {key: (value if not isinstance(value, list) else [list(value[0]), value[1], value[2]])
+                  for key, value in _values.items()}
+
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value)
+                        for (metric, labels), value in values.items() if metric == name)
+        if not series:
+            continue
+
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in series:
+            if metric_type != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Write the metrics to a file atomically, so a collector never reads a half-written file
+def write_textfile(path=None):
+    path = path or METRICS_FILE
+    if not path:
+        return
+    with open(path + ".tmp", "w") as metrics_file:
+        metrics_file.write(render())
+    os.replace(path + ".tmp", path)
+
+
+# Answers GET /metrics with the rendered metrics
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # keep scrapes out of the app's log
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+# set once starting the server failed (e.g. the port is taken), so it isn't tried again on every rerun
+_serve_failed = False
+
+
+# Serve the metrics on http://host:port/metrics from a background thread, on the loopback interface unless
+# another host is given. Safe to call on every Streamlit rerun: the server is only started once per process.
+# If the port can't be bound, a warning is given once and the caller carries on without the endpoint.
+def serve(port=None, host=None):
+    global _server, _serve_failed
+    port = port or METRICS_PORT
+    host = host or METRICS_HOST
+    with _lock:
+        if _server is not None or _serve_failed or not port:
+            return _server
+
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as error:
+            _serve_failed = True
+            warnings.warn(f"Could not serve metrics on {host}:{port}: {error}. Continuing without the endpoint.",
+                          RuntimeWarning)
+            return None
+
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
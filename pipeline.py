@@ -0,0 +1,321 @@
+# Pipelined batch cleaning. Reading and hashing the uploads, the pre-flight checks, loading and cleaning, and
+# saving the cleaned workbook each run in their own thread, with small bounded queues between them, so while
+# one file is being cleaned the next is already being read and checked and the previous one saved. Batches can
+# also be cleaned in worker processes, which hand their results back through shared memory.
+
+import io
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+import metrics
+from engine import (MEMORY_BUDGET, clean_workbook, content_hash, load_and_clean, preflight, record_outcome,
+                    serialize_workbook)
+from metrics import observe
+from shared_results import attach_cleaned, discard_shared, release_segment, share_cleaned
+
+
+# files each queue holds before the stage feeding it waits, which bounds how many workbooks are in memory
+QUEUE_DEPTH = 2
+
+# one file on its way through the pipeline: its position in the batch as uploaded, its name and source, the
+# content hash, whether an earlier file of the batch had the same content (and so isn't cleaned again), the
+# intermediate results of each stage, the error that stopped it, the time spent in the stages so far, when it
+# was cleaned in a worker process, the shared memory segment holding its result (see release) and whether its
+# result was cleaned earlier
+BatchItem = namedtuple('BatchItem', ['index', 'file_name', 'source', 'digest', 'duplicate', 'file_data',
+                                     'workbook', 'sheets', 'cleaned', 'error', 'elapsed', 'segment', 'cached'],
+                       defaults=[None, False, None, None, None, None, None, 0.0, None, False])
+
+# marks the end of the batch on a queue
+_DONE = object()
+
+# number of worker processes -> the process pool with that many workers, kept for the life of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Define helper function to put an item on a queue, giving up if the batch is abandoned while waiting
+def _put(outbox, item, stop):
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+# Define helper function to run one stage: take items off the inbox, apply the stage and pass them on. Items
+# that already failed, or are duplicates, go straight through.
+def _run_stage(stage, inbox, outbox, stop):
+    while not stop.is_set():
+        try:
+            item = inbox.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            _put(outbox, _DONE, stop)
+            return
+
+        if item.error is None and not item.duplicate:
+            started = time.perf_counter()
+            try:
+                item = stage(item)
+            except Exception as error:
+                item = item._replace(error=error)
+            item = item._replace(elapsed=item.elapsed + time.perf_counter() - started)
+        _put(outbox, item, stop)
+
+
+# Define helper function to hash an upload given as bytes or as a binary file object, without copying
+# in-memory buffers
+def _digest(source):
+    if hasattr(source, "getbuffer"):
+        with source.getbuffer() as view:
+            return content_hash(view)
+    if hasattr(source, "read"):
+        digest = content_hash(source.read())
+        source.seek(0)
+        return digest
+    return content_hash(source)
+
+
+# Define helper function to estimate the cost of cleaning an upload from its size, which tracks its row count
+# closely for these exports and is known without opening the workbook
+def _estimated_cost(source):
+    if hasattr(source, "getbuffer"):
+        with source.getbuffer() as view:
+            return view.nbytes
+    if hasattr(source, "seek"):
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+        return size
+    return len(source)
+
+
+# Define helper function to feed the uploads into the pipeline, hashing each (unless its hash is known
+# already) so repeated content is only cleaned once. An upload that can't be read goes through as a failed
+# item, and the end of the batch is always marked, so the consumer never waits for items that won't come.
+def _read_uploads(uploads, outbox, stop):
+    seen = set()
+    try:
+        for index, file_name, source, digest in uploads:
+            if stop.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                digest = digest or _digest(source)
+            except Exception as error:
+                _put(outbox, BatchItem(index, file_name, source, error=error,
+                                       elapsed=time.perf_counter() - started), stop)
+                continue
+            _put(outbox, BatchItem(index, file_name, source, digest, digest in seen,
+                                   elapsed=time.perf_counter() - started), stop)
+            seen.add(digest)
+    finally:
+        _put(outbox, _DONE, stop)
+
+
+# Define helper function to read an upload's bytes to send it to a worker process
+def _read_bytes(source):
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "read"):
+        file_bytes = source.read()
+        source.seek(0)
+        return file_bytes
+    return bytes(source)
+
+
+# Get the process pool with `workers` worker processes. It is started on first use and then shared by every
+# batch (and session) of this process, so only the first batch pays for starting the workers. The workers are
+# started from a fork server, since forking this (threaded) process directly can deadlock.
+def worker_pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # start the resource tracker first, so the workers share it and their segments survive them
+            resource_tracker.ensure_running()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+            _pools[workers] = pool
+        return pool
+
+
+# Define helper function to forget a pool that broke (e.g. a worker was killed), so the next batch starts a
+# fresh one
+def _discard_pool(workers, pool):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Define helper function to clean one upload in a worker process. The result goes back through shared memory;
+# the errors and the metrics recorded while cleaning (for the parent to merge) are pickled.
+def _clean_in_worker(file_name, file_bytes, memory_budget, all_sheets):
+    # start from an empty registry, so only this file's metrics are sent back to the parent
+    metrics.collect()
+    try:
+        shared = share_cleaned(clean_workbook(
+            file_name, file_bytes, memory_budget=memory_budget, all_sheets=all_sheets))
+    except Exception as error:
+        return None, error, metrics.collect()
+    return shared, None, metrics.collect()
+
+
+# Define helper function to clean the batch in the shared pool of worker processes, yielding the items in the
+# order they were submitted. Results finished but not yet handed out when the generator is closed are freed.
+def _clean_in_processes(uploads, workers, memory_budget, all_sheets):
+    pool = worker_pool(workers)
+    pending = []
+    try:
+        seen = set()
+        for index, file_name, source, digest in uploads:
+            file_bytes = _read_bytes(source)
+            digest = digest or content_hash(file_bytes)
+            item = BatchItem(index, file_name, source, digest, digest in seen)
+            seen.add(digest)
+            future = None if item.duplicate else pool.submit(
+                _clean_in_worker, file_name, file_bytes, memory_budget, all_sheets)
+            pending.append((item, future))
+
+        while pending:
+            item, future = pending.pop(0)
+            if future is not None:
+                shared, error, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                if error is not None:
+                    item = item._replace(error=error)
+                else:
+                    cleaned, segment = attach_cleaned(shared)
+                    item = item._replace(cleaned=cleaned, segment=segment)
+            yield item
+    except BrokenProcessPool:
+        _discard_pool(workers, pool)
+        raise
+    finally:
+        for _, future in pending:
+            if future is None or future.cancel() or future.exception() is not None:
+                continue
+            shared = future.result()[0]
+            if shared is not None:
+                discard_shared(shared)
+
+
+# Free the shared memory behind an item cleaned in a worker process, once its result is no longer needed. Its
+# data can't be used after that.
+def release(item):
+    if item.segment is not None:
+        release_segment(item.segment, item.cleaned)
+
+
+# Define helper function to clean the batch one file after another on the calling thread, for memory-budget
+# mode (whose peak memory per file can't be measured while other files are being processed at the same time)
+# and for profiling (cProfile only follows the thread it was enabled on)
+def _clean_sequentially(uploads, memory_budget, all_sheets):
+    seen = set()
+    for index, file_name, source, digest in uploads:
+        digest = digest or _digest(source)
+        item = BatchItem(index, file_name, source, digest, digest in seen)
+        seen.add(digest)
+        if not item.duplicate:
+            try:
+                item = item._replace(cleaned=clean_workbook(
+                    file_name, source, memory_budget=memory_budget, all_sheets=all_sheets))
+            except Exception as error:
+                item = item._replace(error=error)
+        yield item
+
+
+# Define helper function to yield the uploads cleaned earlier, found in `done` by their name and content hash,
+# with their earlier result, followed by the other uploads of the same content as duplicates. Returns the
+# remaining uploads, with their content hash, to be cleaned.
+def _take_cached(uploads, done):
+    digests = [_digest(source) for _, _, source, _ in uploads]
+    cached = {digest for (_, file_name, _, _), digest in zip(uploads, digests) if (file_name, digest) in done}
+
+    fresh = []
+    duplicates = []
+    seen = set()
+    for (index, file_name, source, _), digest in zip(uploads, digests):
+        if digest not in cached:
+            fresh.append((index, file_name, source, digest))
+        elif (file_name, digest) in done and digest not in seen:
+            seen.add(digest)
+            yield BatchItem(index, file_name, source, digest, cleaned=done[file_name, digest], cached=True)
+        else:
+            duplicates.append(BatchItem(index, file_name, source, digest, True, cached=True))
+
+    yield from duplicates
+    return fresh
+
+
+# Clean a batch of uploads, given as (file name, bytes or binary file object) pairs, and yield one BatchItem
+# per upload as soon as it is done: `cleaned` holds the CleanedFile, or `error` the exception the file failed
+# with; duplicates of an earlier upload are flagged and not cleaned again. `done` maps the (file name, content
+# hash) of files cleaned earlier (e.g. in a previous run of the app) to their CleanedFile: those uploads are
+# not cleaned again but yielded with their earlier result, flagged as cached. Files are cleaned in upload order,
+# or with shortest_first smallest first, so the quick ones are ready early; `index` gives each item's place in
+# the upload order. Every file cleaned is counted in the metrics registry. Closing the generator early (e.g. after
+# the first error) stops the pipeline. With `sequential`, the files are cleaned one after another on the
+# calling thread instead, e.g. so a profiler running on it sees the cleaning.
+#
+# With `workers`, the files are cleaned in the process-wide pool of that many worker processes instead (see
+# worker_pool). Their results come back through shared memory: `cleaned.data` is then a memoryview over the
+# shared segment, so pass each item to release() once it has been used (e.g. packed into the bundle).
+def clean_batch(uploads, all_sheets=False, memory_budget=None, depth=QUEUE_DEPTH, shortest_first=False,
+                workers=None, sequential=False, done=None):
+    uploads = [(index, file_name, source, None) for index, (file_name, source) in enumerate(uploads)]
+    if done:
+        uploads = yield from _take_cached(uploads, done)
+        if not uploads:
+            return
+    if shortest_first:
+        uploads.sort(key=lambda upload: _estimated_cost(upload[2]))
+
+    memory_budget = MEMORY_BUDGET if memory_budget is None else memory_budget
+    if workers:
+        yield from _clean_in_processes(uploads, workers, memory_budget, all_sheets)
+        return
+    if memory_budget or sequential:
+        yield from _clean_sequentially(uploads, memory_budget, all_sheets)
+        return
+
+    def check(item):
+        return item._replace(file_data=preflight(item.file_name, item.source, all_sheets))
+
+    def clean(item):
+        workbook, sheets = load_and_clean(item.file_name, item.file_data, all_sheets)
+        return item._replace(workbook=workbook, sheets=sheets)
+
+    def save(item):
+        # drop the workbook as soon as it is saved
+        return item._replace(cleaned=serialize_workbook(item.file_name, item.workbook, item.sheets),
+                             workbook=None, file_data=None)
+
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=depth) for _ in range(4)]
+    threads = [threading.Thread(target=_read_uploads, args=(uploads, queues[0], stop), daemon=True)]
+    for stage, inbox, outbox in zip([check, clean, save], queues, queues[1:]):
+        threads.append(threading.Thread(target=_run_stage, args=(stage, inbox, outbox, stop), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if not item.duplicate:
+                record_outcome(item.cleaned, item.error)
+                observe("cleaning_stage_duration_seconds", item.elapsed, stage="total")
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
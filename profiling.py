@@ -0,0 +1,97 @@
+# Opt-in profiling of the cleaning pipeline with cProfile (time) and tracemalloc (memory)
+
+import cProfile
+import marshal
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# number of rows kept in the hot-function and allocation tables
+TOP_N = 25
+
+# snapshot of the profiled run taken while the most memory was traced, with that traced size; None when no
+# profiled run is active. Filled by snapshot_workbook, since the openpyxl workbooks are gone once the run ends.
+_live_snapshot = None
+_live_snapshot_lock = threading.Lock()
+
+
+# Define helper function to turn the profiler output into a table of the functions with the most own time
+def hot_functions(stats, top_n=TOP_N):
+    rows = []
+    for (file_name, line, function), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+        rows.append((f"{function} ({file_name}:{line})",
+                    calls, own_time, cumulative_time))
+
+    table = pd.DataFrame(
+        rows, columns=["Function", "Calls", "Own Time (s)", "Cumulative Time (s)"])
+    return table.sort_values("Own Time (s)", ascending=False).head(top_n).reset_index(drop=True)
+
+
+# Define helper function to turn a tracemalloc snapshot into a table of the lines holding the most memory
+def allocation_sites(snapshot, top_n=TOP_N):
+    rows = []
+    for statistic in snapshot.statistics("lineno")[:top_n]:
+        frame = statistic.traceback[0]
+        rows.append((f"{frame.filename}:{frame.lineno}",
+                    statistic.size / 1024, statistic.count))
+
+    return pd.DataFrame(rows, columns=["Location", "Size (KiB)", "Blocks"])
+
+
+# Take an allocation snapshot during a profiled run if more memory is traced now than at the last one. Called
+# while a cleaned workbook is still open so the allocation table shows what the workbooks hold at their peak;
+# does nothing outside a profiled run.
+def snapshot_workbook():
+    global _live_snapshot
+    with _live_snapshot_lock:
+        if _live_snapshot is None or not tracemalloc.is_tracing():
+            return
+        current = tracemalloc.get_traced_memory()[0]
+        if current > _live_snapshot[1]:
+            _live_snapshot = (tracemalloc.take_snapshot(), current)
+
+
+# Profile everything run inside the block. The yielded dict is filled once the block exits with the raw pstats
+# dump ('pstats', readable with pstats.Stats), the hot-function and allocation tables, the run time and the
+# peak traced memory. The allocation table comes from the largest snapshot_workbook snapshot, or from the end
+# of the run if none was taken ('allocations_at' says which). tracemalloc is process-wide, so allocations from other sessions running at the same
+# time are included.
+@contextmanager
+def profile_run(top_n=TOP_N):
+    global _live_snapshot
+    report = {}
+
+    # leave tracemalloc alone if someone else (e.g. a concurrent profiled session) already started it
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    with _live_snapshot_lock:
+        _live_snapshot = (None, 0)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        with _live_snapshot_lock:
+            snapshot, _ = _live_snapshot
+            _live_snapshot = None
+        report["allocations_at"] = "peak" if snapshot is not None else "end"
+        if snapshot is None:
+            snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+
+        stats = pstats.Stats(profiler)
+        report["pstats"] = marshal.dumps(stats.stats)
+        report["hot_functions"] = hot_functions(stats, top_n)
+        report["allocations"] = allocation_sites(snapshot, top_n)
+        report["total_time"] = stats.total_tt
+        report["peak_memory"] = peak
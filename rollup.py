@@ -0,0 +1,97 @@
+# Consolidated rollup of every survey uploaded in one batch
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+from summary import GROUPS, stack_frames, summarize_stacked
+from writers import write_workbook
+
+
+ROLLUP_FILE_NAME = "Survey_Rollup.xlsx"
+
+# label of the cross-survey row in the 'By Template' sheet
+ALL_SURVEYS = "All surveys"
+
+
+# Define helper function to name the rollup column of a summary group, e.g. 'Trust' or 'Trust (Leader)'
+def group_column(category, split):
+    return f"{category} ({split})" if split else category
+
+
+# rollup columns in the order the summary tables are written
+GROUP_COLUMNS = [group_column(category, split)
+                 for category, split in zip(GROUPS['Category'], GROUPS['Split'])]
+
+
+# Define helper function to lay a long summary out wide: one row per key, one column per category group
+def wide_rollup(summary, by):
+    summary = summary.assign(Column=[group_column(category, split) for category, split in zip(
+        summary['Category'], summary['Split'])])
+    table = summary.pivot(index=by, columns='Column', values='Mean')
+    return table.reindex(index=pd.unique(summary[by]), columns=[
+        column for column in GROUP_COLUMNS if column in table.columns])
+
+
+# Stack every survey of the batch into one long question table. `surveys` holds (file name, template,
+# question table) tuples.
+def stack_surveys(surveys):
+    names = [name for name, _, _ in surveys]
+    frames = [df for _, _, df in surveys]
+    stacked = stack_frames(frames, names)
+    stacked.insert(1, 'Template', np.repeat(
+        [template for _, template, _ in surveys], [len(df) for df in frames]))
+    return stacked
+
+
+# Build the rollup sheets: category averages per survey, per template and across all surveys, plus every
+# question of every survey in long format
+def build_rollup(surveys):
+    stacked = stack_surveys(surveys)
+    stacked['All'] = ALL_SURVEYS
+
+    # one pass over the stacked questions per rollup level
+    by_survey = wide_rollup(summarize_stacked(stacked, 'File'), 'File')
+    by_template = pd.concat([
+        wide_rollup(summarize_stacked(stacked, 'Template'), 'Template'),
+        wide_rollup(summarize_stacked(stacked, 'All'), 'All'),
+    ])
+
+    overall_by_survey = stacked.groupby('File', sort=False)[
+        'Avg. Score (%)'].mean()
+    overall_by_template = pd.concat([
+        stacked.groupby('Template', sort=False)['Avg. Score (%)'].mean(),
+        pd.Series({ALL_SURVEYS: stacked['Avg. Score (%)'].mean()}),
+    ])
+    surveys_by_template = pd.concat([
+        stacked.groupby('Template', sort=False)['File'].nunique(),
+        pd.Series({ALL_SURVEYS: stacked['File'].nunique()}),
+    ])
+
+    templates = stacked.drop_duplicates('File').set_index('File')['Template']
+    by_survey.insert(0, 'Template', templates.reindex(by_survey.index))
+    by_survey.insert(1, 'Overall Average (%)',
+                     overall_by_survey.reindex(by_survey.index))
+    by_template.insert(0, 'Surveys', surveys_by_template.reindex(
+        by_template.index).astype(int))
+    by_template.insert(1, 'Overall Average (%)',
+                       overall_by_template.reindex(by_template.index))
+
+    by_survey.index.name = 'File'
+    by_template.index.name = 'Template'
+
+    return {
+        'By Survey': by_survey.round(1).reset_index(),
+        'By Template': by_template.round(1).reset_index(),
+        'Questions': stacked.drop(columns='All'),
+    }
+
+
+# Write the rollup sheets to an in-memory Excel workbook, widening the label column and leaving room for the
+# category names in the header
+def write_rollup(sheets, engine=None):
+    return write_workbook({
+        sheet_name: (sheet, {get_column_letter(column): 40 if column == 1 else 18
+                             for column in range(1, sheet.shape[1] + 1)})
+        for sheet_name, sheet in sheets.items()
+    }, engine)
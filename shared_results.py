@@ -0,0 +1,78 @@
+# Hand cleaned files back from worker processes through shared memory instead of pickling them. The worker
+# writes the cleaned workbook's bytes and the float32 scores of its sheets into one shared memory segment and
+# returns a small descriptor; the parent maps the segment, uses the bytes in place (e.g. straight into the zip
+# writer), then releases it. This saves a full copy of every workbook across the process boundary.
+
+from collections import namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from engine import CleanedFile
+
+
+# what a worker returns for one cleaned file: the shared memory segment's name, the cleaned file name, the
+# size of the workbook bytes at the start of the segment, the CleanedSheet of every survey sheet with its
+# scores replaced by their (offset, count) in the segment, and the peak memory in memory-budget mode
+SharedCleanedFile = namedtuple(
+    'SharedCleanedFile', ['segment_name', 'file_name', 'data_size', 'sheets', 'peak_memory'])
+
+# byte alignment of the score arrays in a segment
+SCORE_ALIGNMENT = np.dtype(np.float32).itemsize
+
+
+# Copy a cleaned file into a new shared memory segment (in the worker process) and return its descriptor. The
+# segment outlives the worker's handle on it; the process that attaches it releases it.
+def share_cleaned(cleaned):
+    # the workbook bytes first, then each sheet's scores, aligned for float32
+    offsets = []
+    size = len(cleaned.data)
+    for sheet in cleaned.sheets:
+        size += -size % SCORE_ALIGNMENT
+        offsets.append(size)
+        size += sheet.scores.nbytes
+
+    segment = SharedMemory(create=True, size=max(size, 1))
+    try:
+        segment.buf[:len(cleaned.data)] = cleaned.data
+        for sheet, offset in zip(cleaned.sheets, offsets):
+            segment.buf[offset:offset + sheet.scores.nbytes] = sheet.scores.tobytes()
+    except Exception:
+        segment.close()
+        segment.unlink()
+        raise
+
+    sheets = [sheet._replace(scores=(offset, len(sheet.scores)))
+              for sheet, offset in zip(cleaned.sheets, offsets)]
+    shared = SharedCleanedFile(segment.name, cleaned.file_name, len(cleaned.data), sheets, cleaned.peak_memory)
+    segment.close()
+    return shared
+
+
+# Map a shared cleaned file (in the parent process). Returns the CleanedFile, whose data is a memoryview over
+# the segment, and the segment to pass to release_segment with it once it is used. The scores are only a few
+# hundred bytes per sheet, so they are copied out rather than left as views that would pin the segment.
+def attach_cleaned(shared):
+    segment = SharedMemory(name=shared.segment_name)
+    sheets = []
+    for sheet in shared.sheets:
+        offset, count = sheet.scores
+        sheets.append(sheet._replace(
+            scores=np.frombuffer(segment.buf, dtype=np.float32, count=count, offset=offset).copy()))
+    cleaned = CleanedFile(shared.file_name, sheets, segment.buf[:shared.data_size], shared.peak_memory)
+    return cleaned, segment
+
+
+# Free a shared segment: remove its name, release the data view of the cleaned file attached from it (if any)
+# and unmap it. The data can't be used after that; anything still holding on to it (e.g. a slice of it) raises
+# a BufferError here rather than keeping the segment mapped.
+def release_segment(segment, cleaned=None):
+    segment.unlink()
+    if cleaned is not None:
+        cleaned.data.release()
+    segment.close()
+
+
+# Free a segment created by share_cleaned that was never attached, e.g. when a batch is abandoned
+def discard_shared(shared):
+    release_segment(SharedMemory(name=shared.segment_name))
@@ -0,0 +1,211 @@
+# Category summary engine: every 1st-, 2nd- and 3rd-order statistic for one or many files in a single pass
+
+import numpy as np
+import pandas as pd
+
+from templates import CATEGORY_1, CATEGORY_2, CATEGORY_3, NOT_APPLICABLE
+
+
+LEVELS = ['1st', '2nd', '3rd']
+
+# every (level, category, split) group a file can contribute to, in the order the summary tables are written.
+# The 3rd-order groups are the 2nd-order categories split between Leader and Team questions.
+GROUPS = pd.DataFrame(
+    [('1st', category, '') for category in CATEGORY_1]
+    + [('2nd', category, '') for category in CATEGORY_2]
+    + [('3rd', category, split) for category in CATEGORY_2 for split in CATEGORY_3],
+    columns=['Level', 'Category', 'Split'])
+N_GROUPS = len(GROUPS)
+
+# offsets of each level inside the group code space
+OFFSET_2ND = len(CATEGORY_1)
+OFFSET_3RD = OFFSET_2ND + len(CATEGORY_2)
+
+# bootstrap confidence intervals of the category averages: resamples per group, confidence level and the
+# seed, fixed so the same file always gets the same intervals
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+
+# row labels used when a statistic is laid out in wide format
+STATISTIC_LABELS = {
+    'Mean': 'Avg. Score (%)',
+    'Count': 'No. of Questions',
+    'Std': 'Std. Dev. (%)',
+    'CI Low': f'{CONFIDENCE:.0%} CI Low (%)',
+    'CI High': f'{CONFIDENCE:.0%} CI High (%)',
+}
+
+
+# statistics of each group kept by pack_summary, in the order of its columns
+PACKED_STATISTICS = ['Mean', 'Count', 'Std', 'CI Low', 'CI High']
+
+# (level, category, split) -> position of the group in GROUPS
+GROUP_INDEX = {group: index for index, group in enumerate(
+    zip(GROUPS['Level'], GROUPS['Category'], GROUPS['Split']))}
+
+
+# Define helper function to map every question of a file onto its 1st-, 2nd- and 3rd-order group codes.
+# Questions without a 3rd-order group (Review/No leader templates, 'Health' questions) get -1.
+def group_codes(df):
+    first = df['1st-Order Category'].cat.codes.to_numpy(dtype=np.int64)
+    second = df['2nd-Order Category'].cat.codes.to_numpy(dtype=np.int64)
+
+    third = np.full(len(df), -1, dtype=np.int64)
+    if '3rd-Order Category' in df:
+        split = df['3rd-Order Category'].cat.codes.to_numpy(dtype=np.int64)
+        has_split = (split >= 0) & (split < len(CATEGORY_3))
+        third[has_split] = OFFSET_3RD + \
+            second[has_split] * len(CATEGORY_3) + split[has_split]
+
+    return np.concatenate([first, OFFSET_2ND + second, third])
+
+
+# Define helper function to stack several question tables into one long frame with a key column. The category
+# columns keep their categorical dtype, including for files without a 3rd-order category.
+def stack_frames(frames, keys, key_name='File'):
+    stacked = []
+    for key, df in zip(keys, frames):
+        df = df.copy()
+        if '3rd-Order Category' not in df:
+            df['3rd-Order Category'] = pd.Categorical(
+                [None] * len(df), categories=CATEGORY_3 + [NOT_APPLICABLE])
+        df.insert(0, key_name, key)
+        stacked.append(df)
+
+    return pd.concat(stacked, ignore_index=True)
+
+
+# Define helper function to flatten a stacked question table into one (key, group) code per question and
+# level, with the matching scores. Questions without a group at a level and blank scores are dropped.
+def keyed_group_scores(stacked, by):
+    key_codes, keys = pd.factorize(stacked[by], sort=False)
+
+    codes = group_codes(stacked)
+    scores = np.tile(stacked['Avg. Score (%)'].to_numpy(dtype=float), 3)
+
+    valid = (codes >= 0) & ~np.isnan(scores)
+    codes = (codes + np.tile(key_codes, 3) * N_GROUPS)[valid]
+    return keys, codes, scores[valid]
+
+
+# Define helper function to bootstrap the mean of every (key, group) code at once. Every resample redraws
+# each group's questions with replacement, so one uniform draw per question and resample covers all groups
+# in a single array operation. Returns the lower and upper percentile bounds, one per group in code order.
+def bootstrap_intervals(codes, scores, n_resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=BOOTSTRAP_SEED):
+    # lay the questions of each group out next to each other
+    order = np.argsort(codes, kind='stable')
+    codes, scores = codes[order], scores[order]
+    _, starts, sizes = np.unique(codes, return_index=True, return_counts=True)
+
+    # every slot draws one question from its own group: its group's start plus a random offset within it.
+    # Single precision halves the cost of the draws; the clip guards against a product rounding up to the size.
+    slot_starts = np.repeat(starts, sizes).astype(np.int32)
+    slot_sizes = np.repeat(sizes, sizes)
+    rng = np.random.default_rng(seed)
+    offsets = (rng.random((n_resamples, len(codes)), dtype=np.float32)
+               * slot_sizes.astype(np.float32)).astype(np.int32)
+    draws = slot_starts + np.minimum(offsets, (slot_sizes - 1).astype(np.int32))
+
+    means = np.add.reduceat(scores[draws], starts, axis=1) / sizes
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail], axis=0)
+
+    # a single question gives no spread to resample
+    low[sizes < 2] = np.nan
+    high[sizes < 2] = np.nan
+    return low, high
+
+
+# Summarize a stacked question table for every distinct value of the `by` column. Every question score is
+# counted once per level and all keys share one bincount over (key, group) codes. Returns a long DataFrame
+# with one row per key and observed group; with intervals, bootstrap confidence bounds of each mean are added
+# as 'CI Low' and 'CI High'.
+def summarize_stacked(stacked, by, intervals=False):
+    keys, codes, scores = keyed_group_scores(stacked, by)
+
+    size = len(keys) * N_GROUPS
+    count = np.bincount(codes, minlength=size)
+    total = np.bincount(codes, weights=scores, minlength=size)
+    squares = np.bincount(codes, weights=scores * scores, minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = (squares - count * mean * mean) / (count - 1)
+    std = np.sqrt(np.clip(variance, 0, None))
+    std[count < 2] = np.nan
+
+    summary = pd.concat([GROUPS] * len(keys), ignore_index=True)
+    summary.insert(0, by, np.repeat(np.asarray(keys, dtype=object), N_GROUPS))
+    summary['Mean'] = mean
+    summary['Count'] = count
+    summary['Std'] = std
+
+    summary = summary[summary['Count'] > 0].reset_index(drop=True)
+
+    # the bootstrap returns one bound per observed code, in the same (key, group) order as the rows left
+    if intervals:
+        summary['CI Low'], summary['CI High'] = bootstrap_intervals(codes, scores)
+
+    summary['Level'] = pd.Categorical(summary['Level'], LEVELS)
+    summary['Category'] = pd.Categorical(
+        summary['Category'], CATEGORY_1 + CATEGORY_2)
+    return summary
+
+
+# Summarize many files at once (keys should be unique, e.g. the file names)
+def summarize_batch(frames, keys=None, intervals=False):
+    keys = list(range(len(frames))) if keys is None else list(keys)
+    return summarize_stacked(stack_frames(frames, keys), 'File', intervals)
+
+
+# Summarize a single file (see summarize_batch)
+def summarize(df, key=0, intervals=False):
+    return summarize_batch([df], keys=[key], intervals=intervals)
+
+
+# Pack a single file's summary into one array for keeping it around: a row per group of GROUPS and a column
+# per statistic of PACKED_STATISTICS, NaN for groups the file has no questions in (and for the confidence
+# intervals of a summary without them)
+def pack_summary(summary):
+    packed = np.full((N_GROUPS, len(PACKED_STATISTICS)), np.nan)
+    rows = [GROUP_INDEX[group] for group in zip(summary['Level'], summary['Category'], summary['Split'])]
+    packed[rows] = summary.reindex(columns=PACKED_STATISTICS).to_numpy(dtype=float)
+    return packed
+
+
+# Rebuild the summary of pack_summary, keyed by `key` in the `by` column like summarize does
+def unpack_summary(packed, key=0, by='File'):
+    present = ~np.isnan(packed[:, PACKED_STATISTICS.index('Count')])
+    summary = GROUPS[present].reset_index(drop=True)
+    summary.insert(0, by, np.full(len(summary), key, dtype=object))
+    for column, statistic in enumerate(PACKED_STATISTICS):
+        summary[statistic] = packed[present, column]
+    summary['Count'] = summary['Count'].astype(np.int64)
+
+    summary['Level'] = pd.Categorical(summary['Level'], LEVELS)
+    summary['Category'] = pd.Categorical(
+        summary['Category'], CATEGORY_1 + CATEGORY_2)
+    return summary
+
+
+# Lay one level of a single file's summary out in wide format: one column per category (in template order)
+# and one row per split, labelled the way the summary tables in the workbook are. With decimals, the values
+# are rounded (half to even, like round()) in one vectorized pass.
+def wide_table(summary, level, statistic='Mean', decimals=None):
+    rows = summary[summary['Level'] == level]
+    categories = [category for category in rows['Category'].cat.categories
+                  if category in set(rows['Category'])]
+
+    table = rows.pivot(index='Split', columns='Category',
+                       values=statistic).reindex(columns=categories)
+    table.columns = list(table.columns)
+    table.index = [f"{split} {STATISTIC_LABELS[statistic]}".strip()
+                   for split in table.index]
+    return table if decimals is None else table.round(decimals)
+
+
+# Lay every level of a single file's summary out in wide format, keyed by level
+def wide_tables(summary, statistic='Mean', decimals=None):
+    levels = [level for level in LEVELS if (summary['Level'] == level).any()]
+    return {level: wide_table(summary, level, statistic, decimals) for level in levels}
@@ -0,0 +1,79 @@
+# Synthetic Survey Monkey exports for load tests and output comparisons. The layout mimics a real export:
+# report metadata above row 23, the question table from row 24 in survey (not question) order, and one detail
+# block per question further down holding its standard deviation.
+
+import io
+import random
+
+import openpyxl
+from openpyxl.styles import Alignment, Font, PatternFill
+
+from templates import LEADER_FIRST_QUESTION, REPETITIONS
+
+
+# number of the first question of each synthetic export. Real Review, No leader and Team exports don't all
+# start at Q1; only the Leader export's Q7 start is relied on.
+FIRST_QUESTION = {'Review': 1, 'No leader': 1, 'Leader': LEADER_FIRST_QUESTION, 'Team': 1}
+TEMPLATES = list(FIRST_QUESTION)
+
+
+# Build one raw export for the template as xlsx bytes. The same seed always gives the same file.
+def make_export(template, seed=0):
+    rng = random.Random(f"{template}-{seed}")
+    first = FIRST_QUESTION[template]
+    numbers = list(range(first, first + sum(REPETITIONS[template]['1st'])))
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+
+    # report metadata, with a merged title like the real exports
+    ws["A1"] = "Survey Results"
+    ws.merge_cells("A1:C1")
+    for row in range(2, 23):
+        ws[f"A{row}"] = f"Report detail {row}"
+
+    # question table header
+    for column, header in zip("ABC", ["Question", "Difficulty", "Average Score"]):
+        cell = ws[f"{column}23"]
+        cell.value = header
+        cell.font = Font(name="Arial", size=11, bold=True, color="FFFFFF")
+        cell.fill = PatternFill("solid", fgColor="1F2041")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+
+    # question table, in the shuffled order the survey presented the questions
+    shuffled = numbers[:]
+    rng.shuffle(shuffled)
+    for row, number in enumerate(shuffled, start=24):
+        ws[f"A{row}"] = f"Q{number} How consistently does this happen on the team? ({template} item {number})"
+        ws[f"B{row}"] = rng.choice(["Easy", "Moderate", "Hard"])
+        ws[f"C{row}"] = f"{rng.randint(35, 100)}%"
+
+    # one detail block per question, in question order
+    row = 24 + len(numbers) + 3
+    for number in numbers:
+        ws[f"A{row}"] = f"Q{number} detail"
+        ws.merge_cells(f"A{row}:B{row}")
+        ws[f"C{row + 1}"] = "Standard Deviation"
+        ws[f"C{row + 2}"] = round(rng.uniform(4, 32), 2)
+        row += 4
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+# Build a mixed batch of (file name, xlsx bytes) uploads. Leader and Team files come in pairs named after the
+# same client, so they are paired for a Leader-Team comparison.
+def make_batch(size, seed=0):
+    rng = random.Random(seed)
+    batch = []
+    while len(batch) < size:
+        client = f"Client {seed}-{len(batch)}"
+        template = rng.choice(TEMPLATES)
+        if template in ('Leader', 'Team') and len(batch) + 2 <= size:
+            batch.append((f"{client} Leader.xlsx", make_export('Leader', f"{client}-L")))
+            batch.append((f"{client} Team.xlsx", make_export('Team', f"{client}-T")))
+        elif template in ('Review', 'No leader'):
+            batch.append((f"{client} {template}.xlsx", make_export(template, client)))
+
+    return batch
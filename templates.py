@@ -0,0 +1,74 @@
+# Survey template definitions shared by the cleaning app
+
+import numpy as np
+
+
+# 1st-, 2nd-, and 3rd-Order Categories
+CATEGORY_1 = ['THRIVE', 'Just Leader']
+CATEGORY_2 = [
+    'Trust', 'Health', 'Relationships', 'Impact', 'Value', 'Engagement', 'See the Whole Playing Field', 'Build Cultural Competency', 'Give Power Away', 'Take Bold, Courageous Action']
+
+# this level will only pertain to the LEADER and TEAM templates
+CATEGORY_3 = ['Leader', 'Team']
+
+# label used for the 3rd-order category of the 'Health' questions, which are not split between Leader and Team
+NOT_APPLICABLE = 'n/a'
+
+# how many consecutive questions (in question order) fall into each category, per template
+REPETITIONS = {
+    'Review': {
+        '1st': [30, 8],
+        '2nd': [5, 5, 5, 5, 5, 5, 2, 2, 2, 2],
+    },
+    'No leader': {
+        '1st': [35, 12],
+        '2nd': [5, 10, 5, 5, 5, 5, 3, 3, 3, 3],
+    },
+    'Leader': {
+        '1st': [60, 20],
+        '2nd': [10, 10, 10, 10, 10, 10, 5, 5, 5, 5],
+        '3rd': [5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 2, 3, 2, 3, 2, 3, 2, 3],
+    },
+    'Team': {
+        '1st': [60, 20],
+        '2nd': [10, 10, 10, 10, 10, 10, 5, 5, 5, 5],
+        '3rd': [5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 2, 3, 2, 3, 2, 3, 2, 3],
+    },
+}
+
+
+# number of questions of each template
+QUESTION_COUNTS = {template: sum(repetitions['1st']) for template, repetitions in REPETITIONS.items()}
+
+# the Leader and Team templates have the same number of questions; a Leader export's first question is Q7
+LEADER_FIRST_QUESTION = 7
+
+
+# Define helper function to figure out which template a question sequence came from, given its signature
+# (see extraction.question_signature). Only the question count and, to tell Leader from Team, whether the
+# first question is Q7 are relied on; the exports don't all number their questions from the same place.
+# Unknown layouts raise a ValueError instead of guessing.
+def detect_template(signature):
+    first, last, count = signature
+    templates = [template for template, template_count in QUESTION_COUNTS.items() if template_count == count]
+    if templates == ['Leader', 'Team']:
+        templates = ['Leader'] if first == LEADER_FIRST_QUESTION else ['Team']
+    if len(templates) != 1:
+        expected = "; ".join(f"{template} ({template_count} questions)"
+                             for template, template_count in QUESTION_COUNTS.items())
+        raise ValueError(
+            f"Unrecognized survey layout: found {count} questions numbered Q{first} to Q{last}. Expected one of: {expected}.")
+    return templates[0]
+
+
+# Define helper function to expand the category repetitions into one label per question
+def category_labels(template, level):
+    repetitions = REPETITIONS[template][level]
+    if level == '1st':
+        return np.repeat(CATEGORY_1, repetitions)
+    if level == '2nd':
+        return np.repeat(CATEGORY_2, repetitions)
+
+    # the 3rd-order categories alternate Leader / Team within each 2nd-order category
+    labels = np.resize(CATEGORY_3, len(repetitions))
+    return np.repeat(labels, repetitions)
@@ -0,0 +1,68 @@
+# Round-trip tests of the ZIP bundle writer: every bundle must read back with zipfile, member for member
+
+import io
+import zipfile
+
+import pytest
+
+import bundling
+from engine import build_bundle
+
+
+# a mix of members: compressible, incompressible, empty, a UTF-8 name and a memoryview
+MEMBERS = [
+    ("Review_clean.xlsx", b"survey " * 5000),
+    ("random.bin", bytes(range(256)) * 40),
+    ("empty.txt", b""),
+    ("Équipe – Team_clean.xlsx", "données ".encode("utf-8") * 300),
+    ("view.xlsx", memoryview(b"shared " * 700)),
+]
+
+
+# Define helper function to read a bundle back as a list of (name, bytes), checking every CRC on the way
+def read_back(bundle):
+    with zipfile.ZipFile(io.BytesIO(bundle)) as zip_file:
+        assert zip_file.testzip() is None
+        return [(info.filename, zip_file.read(info)) for info in zip_file.infolist()]
+
+
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_round_trip(level):
+    assert read_back(bundling.write_zip(MEMBERS, level)) == [(name, bytes(data)) for name, data in MEMBERS]
+
+
+def test_stored_and_deflated_members():
+    with zipfile.ZipFile(io.BytesIO(bundling.write_zip(MEMBERS, 6))) as zip_file:
+        methods = {info.filename: info.compress_type for info in zip_file.infolist()}
+        names = {info.filename: info.flag_bits & 0x800 for info in zip_file.infolist()}
+
+    # deflated where that makes the member smaller, stored otherwise
+    assert methods["Review_clean.xlsx"] == zipfile.ZIP_DEFLATED
+    assert methods["empty.txt"] == zipfile.ZIP_STORED
+    # only the name outside ASCII is flagged as UTF-8
+    assert names["Équipe – Team_clean.xlsx"] and not names["Review_clean.xlsx"]
+
+
+def test_level_zero_stores_everything():
+    with zipfile.ZipFile(io.BytesIO(bundling.write_zip(MEMBERS, 0))) as zip_file:
+        assert {info.compress_type for info in zip_file.infolist()} == {zipfile.ZIP_STORED}
+
+
+def test_empty_bundle():
+    assert read_back(bundling.write_zip([], 6)) == []
+
+
+def test_large_bundle_falls_back_to_zipfile(monkeypatch):
+    monkeypatch.setattr(bundling, "MAX_MEMBERS", 2)
+    assert read_back(bundling.write_zip(MEMBERS, 6)) == [(name, bytes(data)) for name, data in MEMBERS]
+
+
+def test_build_bundle_takes_bytes_and_buffers():
+    buffer = io.BytesIO(b"comparison " * 100)
+    files = [("a_clean.xlsx", b"cleaned " * 100), ("Leader-Team_Comparison.xlsx", buffer)]
+    bundle = build_bundle(files, compression_level=6)
+
+    assert read_back(bundle) == [("a_clean.xlsx", b"cleaned " * 100),
+                                 ("Leader-Team_Comparison.xlsx", b"comparison " * 100)]
+    # the list is handed over and the buffers closed
+    assert files == [] and buffer.closed
@@ -0,0 +1,42 @@
+# Tests of the Leader-Team pairing of a batch
+
+from comparison import build_pairs, default_pairs, pair_name
+
+
+def test_pair_name():
+    assert pair_name("Acme Leader.xlsx") == "Acme"
+    assert pair_name("acme_team_Q3.xlsx") == "acme Q3"
+    assert pair_name("Teamwork Leader.xlsx") == "Teamwork"
+    assert pair_name("Leader.xlsx") == ""
+
+
+def test_lone_files_are_always_paired():
+    assert default_pairs(["North Leader.xlsx"], ["South Team.xlsx"]) == {"North Leader.xlsx": "South Team.xlsx"}
+
+
+def test_files_are_paired_by_name():
+    leaders = ["Acme Leader.xlsx", "Globex leader.xlsx", "Initech Leader.xlsx"]
+    teams = ["globex_team.xlsx", "Acme Team.xlsx", "Umbrella Team.xlsx"]
+    assert default_pairs(leaders, teams) == {
+        "Acme Leader.xlsx": "Acme Team.xlsx",
+        "Globex leader.xlsx": "globex_team.xlsx",
+        "Initech Leader.xlsx": None,
+    }
+
+
+def test_a_team_file_is_paired_once():
+    leaders = ["Acme Leader.xlsx", "Acme-Leader.xlsx"]
+    assert default_pairs(leaders, ["Acme Team.xlsx", "Other Team.xlsx"]) == {
+        "Acme Leader.xlsx": "Acme Team.xlsx",
+        "Acme-Leader.xlsx": None,
+    }
+
+
+def test_build_pairs():
+    mapping = {"Acme Leader.xlsx": "Acme Team.xlsx", "Globex Leader.xlsx": None,
+               "Acme_Leader.xlsx": "Acme 2 Team.xlsx", "Leader.xlsx": "Team.xlsx"}
+    assert build_pairs(mapping) == [
+        ("Acme", "Acme Leader.xlsx", "Acme Team.xlsx"),
+        ("Acme (2)", "Acme_Leader.xlsx", "Acme 2 Team.xlsx"),
+        ("Leader-Team", "Leader.xlsx", "Team.xlsx"),
+    ]
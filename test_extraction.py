@@ -0,0 +1,71 @@
+# Tests of the question-table extraction: parsing, the question-number checks and the files it rejects
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from errors import CleaningError
+from extraction import extract_survey_frame, parse_percentages, parse_question_numbers, validate_question_order
+
+
+# Define helper function to build a sheet with a question table (rows of question, difficulty, score) at A24
+def survey_sheet(rows):
+    ws = openpyxl.Workbook().active
+    for row, values in enumerate(rows, start=24):
+        for column, value in enumerate(values, start=1):
+            ws.cell(row=row, column=column, value=value)
+    return ws
+
+
+def test_parse_question_numbers():
+    numbers = parse_question_numbers(pd.Series(["Q12 How often", " Q3 Do you", "Question 4", None, "Q07 x"]))
+    assert numbers.tolist() == [12, 3, pd.NA, pd.NA, 7]
+
+
+def test_parse_percentages():
+    scores = parse_percentages(pd.Series(["85%", "85.5 %", 85, 72.25, None, "", "n/a"]))
+    np.testing.assert_array_equal(scores, [85.0, 85.5, 85.0, 72.25, np.nan, np.nan, np.nan])
+
+
+def test_gaps_are_returned():
+    assert validate_question_order(pd.Series([5, 1, 2, 7], dtype="Int64")) == [3, 4, 6]
+    assert validate_question_order(pd.Series([3, 2, 4], dtype="Int64")) == []
+
+
+def test_duplicated_numbers_are_rejected():
+    with pytest.raises(ValueError, match="Q2 appear more than once"):
+        validate_question_order(pd.Series([1, 2, 2, 3], dtype="Int64"))
+
+
+def test_unreadable_numbers_are_rejected():
+    with pytest.raises(ValueError, match="for 1 question"):
+        validate_question_order(pd.Series([1, pd.NA, 3], dtype="Int64"))
+
+
+def test_extract_sorts_and_renumbers():
+    ws = survey_sheet([("Q12 c", "Hard", "70%"), ("Q10 a", "Easy", "90%"), ("Q11 b", "Easy", None)])
+    df, gaps = extract_survey_frame(ws)
+
+    assert df["Questions"].tolist() == ["Q10 a", "Q11 b", "Q12 c"]
+    assert df["Question Order"].tolist() == [1, 2, 3]
+    np.testing.assert_array_equal(df["Avg. Score (%)"], [90.0, np.nan, 70.0])
+    assert gaps == []
+
+
+def test_extract_stops_at_the_first_blank_row():
+    ws = survey_sheet([("Q1 a", "Easy", "50%"), ("Q2 b", "Easy", "60%"), (None,), ("Q9 notes", "", "")])
+    df, _ = extract_survey_frame(ws)
+    assert len(df) == 2
+
+
+def test_empty_table_is_rejected():
+    with pytest.raises(ValueError, match="No questions were found"):
+        extract_survey_frame(survey_sheet([]))
+
+
+def test_all_blank_scores_are_rejected():
+    ws = survey_sheet([("Q1 a", "Easy", None), ("Q2 b", "Easy", ""), ("Q3 c", "Hard", "n/a")])
+    with pytest.raises(CleaningError) as error:
+        extract_survey_frame(ws)
+    assert error.value.reason == "no_scores"
@@ -0,0 +1,94 @@
+# Tests of the category summary engine against plain pandas groupby means, on hand-built question tables
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from summary import pack_summary, summarize, summarize_batch, unpack_summary, wide_tables
+from templates import CATEGORY_1, CATEGORY_2, CATEGORY_3, NOT_APPLICABLE
+
+
+# Define helper function to build a categorized question table from (score, 1st, 2nd, 3rd) rows; a 3rd of
+# False leaves the 3rd-order column out, as for the Review and No leader templates
+def question_table(rows):
+    scores, first, second, third = zip(*rows)
+    df = pd.DataFrame({
+        "Questions": [f"Q{number} question" for number in range(1, len(rows) + 1)],
+        "Difficulty": "Easy",
+        "Avg. Score (%)": np.array(scores, dtype=float),
+        "Question Order": np.arange(1, len(rows) + 1),
+    })
+    df["1st-Order Category"] = pd.Categorical(first, categories=CATEGORY_1)
+    df["2nd-Order Category"] = pd.Categorical(second, categories=CATEGORY_2)
+    if third[0] is not False:
+        df["3rd-Order Category"] = pd.Categorical(third, categories=CATEGORY_3 + [NOT_APPLICABLE])
+    return df
+
+
+REVIEW_LIKE = question_table([
+    (80, 'THRIVE', 'Trust', False),
+    (70, 'THRIVE', 'Trust', False),
+    (np.nan, 'THRIVE', 'Health', False),
+    (55.5, 'THRIVE', 'Health', False),
+    (90, 'Just Leader', 'Give Power Away', False),
+])
+
+LEADER_LIKE = question_table([
+    (80, 'THRIVE', 'Trust', 'Leader'),
+    (60, 'THRIVE', 'Trust', 'Team'),
+    (75, 'THRIVE', 'Trust', 'Leader'),
+    (50, 'THRIVE', 'Health', NOT_APPLICABLE),
+    (np.nan, 'Just Leader', 'Value', 'Team'),
+    (65, 'Just Leader', 'Value', 'Leader'),
+])
+
+
+# Define helper function to compute one level's means the way the app did before the summary engine
+def groupby_means(df, columns):
+    return df.groupby(columns, observed=True)["Avg. Score (%)"].mean().dropna()
+
+
+@pytest.mark.parametrize("df", [REVIEW_LIKE, LEADER_LIKE])
+def test_means_match_groupby(df):
+    summary = summarize(df, "survey")
+
+    for level, columns in [('1st', ['1st-Order Category']), ('2nd', ['2nd-Order Category'])]:
+        rows = summary[summary['Level'] == level]
+        expected = groupby_means(df, columns)
+        assert dict(zip(rows['Category'], rows['Mean'])) == pytest.approx(expected.to_dict())
+
+    if '3rd-Order Category' in df:
+        split = df[df['3rd-Order Category'] != NOT_APPLICABLE]
+        expected = groupby_means(split, ['2nd-Order Category', '3rd-Order Category'])
+        rows = summary[summary['Level'] == '3rd']
+        assert dict(zip(zip(rows['Category'], rows['Split']), rows['Mean'])) == pytest.approx(expected.to_dict())
+
+
+def test_counts_skip_blank_scores():
+    summary = summarize(REVIEW_LIKE)
+    counts = dict(zip(summary['Category'], summary['Count']))
+    assert counts['THRIVE'] == 3 and counts['Health'] == 1
+
+
+def test_health_questions_are_not_split():
+    summary = summarize(LEADER_LIKE)
+    assert 'Health' not in set(summary[summary['Level'] == '3rd']['Category'])
+
+
+def test_batch_matches_single_files():
+    batch = summarize_batch([REVIEW_LIKE, LEADER_LIKE], keys=['a', 'b'])
+    for key, df in [('a', REVIEW_LIKE), ('b', LEADER_LIKE)]:
+        single = summarize(df, key)
+        pd.testing.assert_frame_equal(batch[batch['File'] == key].reset_index(drop=True), single)
+
+
+def test_wide_tables():
+    tables = wide_tables(summarize(LEADER_LIKE), decimals=1)
+    assert list(tables) == ['1st', '2nd', '3rd']
+    assert tables['1st'].loc['Avg. Score (%)', 'THRIVE'] == pytest.approx(66.2)
+    assert tables['3rd'].loc['Leader Avg. Score (%)', 'Trust'] == 77.5
+
+
+def test_pack_round_trip():
+    summary = summarize(LEADER_LIKE, "survey", intervals=True)
+    pd.testing.assert_frame_equal(unpack_summary(pack_summary(summary), "survey"), summary, check_like=True)
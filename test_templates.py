@@ -0,0 +1,50 @@
+# Tests of template detection, which must not depend on where an export starts numbering its questions
+
+import io
+
+import openpyxl
+import pytest
+
+from engine import clean_workbook
+from templates import detect_template
+
+
+# Define helper function to build the signature of a question sequence, as extraction.question_signature does
+def signature(numbers):
+    return min(numbers), max(numbers), len(numbers)
+
+
+@pytest.mark.parametrize("numbers, template", [
+    (range(1, 39), 'Review'),
+    (range(2, 40), 'Review'),
+    (list(range(1, 38)) + [40], 'Review'),
+    (range(1, 48), 'No leader'),
+    (range(5, 52), 'No leader'),
+    (range(7, 87), 'Leader'),
+    (range(1, 81), 'Team'),
+    (range(3, 83), 'Team'),
+    (list(range(1, 80)) + [85], 'Team'),
+])
+def test_detect_template(numbers, template):
+    assert detect_template(signature(list(numbers))) == template
+
+
+@pytest.mark.parametrize("numbers", [range(1, 40), range(7, 50), range(1, 2)])
+def test_unknown_layout(numbers):
+    with pytest.raises(ValueError, match="Unrecognized survey layout"):
+        detect_template(signature(list(numbers)))
+
+
+# a Review export numbered Q2-Q39, which doesn't start at Q1, cleans like any other
+def test_clean_review_not_numbered_from_one():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for row, number in enumerate(reversed(range(2, 40)), start=24):
+        ws[f"A{row}"] = f"Q{number} Question {number}"
+        ws[f"B{row}"] = "Easy"
+        ws[f"C{row}"] = f"{50 + number}%"
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    cleaned = clean_workbook("Review.xlsx", buffer.getvalue())
+    assert [sheet.template for sheet in cleaned.sheets] == ['Review']
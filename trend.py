@@ -0,0 +1,115 @@
+# Cross-wave trend of a repeated survey: several exports of the same template, one per wave (e.g. quarter),
+# aligned by question order and category in one stacked frame, with the change between consecutive waves, the
+# change from the first to the last wave and the slope across all waves, for every question and category
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+from summary import stack_frames, summarize_stacked
+from writers import write_workbook
+
+
+TREND_FILE_NAME = "Survey_Trend.xlsx"
+
+# label of the overall average row in the 'Categories' sheet
+OVERALL = "Overall Average (%)"
+
+
+# Define helper function to label every wave by its file name without the extension, numbering repeats so
+# each label is unique
+def wave_labels(names):
+    labels = []
+    for name in names:
+        label = name.rsplit('.', 1)[0]
+        repeat = 1
+        while label in labels:
+            repeat += 1
+            label = f"{name.rsplit('.', 1)[0]} ({repeat})"
+        labels.append(label)
+    return labels
+
+
+# Define helper function to fit the least-squares slope of every row of a (rows x waves) matrix against the
+# wave number, over the waves that row has a value for. Rows with fewer than two values get NaN.
+def trend_slopes(values):
+    waves = np.broadcast_to(np.arange(values.shape[1], dtype=float), values.shape)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wave_means = np.where(valid, waves, 0).sum(axis=1) / counts
+        value_means = np.where(valid, values, 0).sum(axis=1) / counts
+        wave_offsets = np.where(valid, waves - wave_means[:, None], 0)
+        value_offsets = np.where(valid, values - value_means[:, None], 0)
+        slopes = (wave_offsets * value_offsets).sum(axis=1) / (wave_offsets ** 2).sum(axis=1)
+
+    slopes[counts < 2] = np.nan
+    return slopes
+
+
+# Define helper function to add the trend columns to a wide table with one column per wave: the change
+# between every two consecutive waves, the change from the first to the last wave and the slope (points per
+# wave), all computed on the whole table at once. Returns the wave columns (rounded) with the trend columns.
+def add_trend_columns(table, labels):
+    values = table[labels].to_numpy(dtype=float)
+    changes = pd.DataFrame(np.diff(values, axis=1), index=table.index,
+                           columns=[f"Change {before} to {after}" for before, after in zip(labels, labels[1:])])
+    changes["Change (first to last)"] = values[:, -1] - values[:, 0]
+    changes = changes.round(1)
+    changes["Slope (per wave)"] = trend_slopes(values).round(2)
+    return pd.concat([table[labels].round(1), changes], axis=1)
+
+
+# Build the trend sheets from `surveys`, (name, template, question table) tuples in wave order (oldest first),
+# which must all be of one template. Returns the per-question and per-category trends and the list of waves.
+def build_trend(surveys):
+    templates = list(dict.fromkeys(template for _, template, _ in surveys))
+    if len(templates) > 1:
+        raise ValueError(
+            f"A trend compares waves of one template, but the uploads mix {', '.join(templates)} surveys.")
+    if len(surveys) < 2:
+        raise ValueError("A trend needs at least two waves of the survey.")
+
+    labels = wave_labels([name for name, _, _ in surveys])
+    stacked = stack_frames([df for _, _, df in surveys], labels, key_name='Wave')
+
+    # every question of every wave, aligned by question order: one row per question, one column per wave
+    scores = stacked.pivot(index='Question Order', columns='Wave', values='Avg. Score (%)')[labels]
+    first = surveys[0][2]
+    category_columns = [column for column in first.columns if column.endswith('-Order Category')]
+    questions = first.set_index('Question Order')[['Questions'] + category_columns]
+    questions = pd.concat([questions, add_trend_columns(scores, labels)], axis=1).reset_index()
+
+    # every category average of every wave from one summary pass, plus the overall average of each wave
+    summary = summarize_stacked(stacked, 'Wave')
+    summary['Order'] = summary['Level'].astype(str) + "-Order"
+    means = summary.pivot(index=['Level', 'Order', 'Category', 'Split'], columns='Wave', values='Mean')[labels]
+    means = means.reset_index(level=['Order', 'Category', 'Split']).reset_index(drop=True)
+    overall = stacked.groupby('Wave', sort=False)['Avg. Score (%)'].mean()
+    means = pd.concat([pd.DataFrame([{'Order': '', 'Category': OVERALL, 'Split': '', **overall[labels].to_dict()}]),
+                       means], ignore_index=True)
+    categories = pd.concat([means[['Order', 'Category', 'Split']], add_trend_columns(means, labels)], axis=1)
+    categories = categories.rename(columns={'Split': '3rd-Order Category'})
+    if not (categories['3rd-Order Category'] != '').any():
+        categories = categories.drop(columns='3rd-Order Category')
+
+    waves = pd.DataFrame({'Wave': labels, 'File': [name for name, _, _ in surveys],
+                          'Template': templates[0], 'Questions': [len(df) for _, _, df in surveys]})
+
+    return {
+        'Categories': categories,
+        'Questions': questions,
+        'Waves': waves,
+    }
+
+
+# Write the trend sheets to an in-memory Excel workbook, leaving room for the question texts and the
+# category names
+def write_trend(sheets, engine=None):
+    widths = {'Categories': {'B': 30, 'C': 19}, 'Questions': {'B': 75}, 'Waves': {'A': 40, 'B': 40}}
+    return write_workbook({
+        sheet_name: (sheet, {get_column_letter(column): widths[sheet_name].get(get_column_letter(column), 18)
+                             for column in range(1, sheet.shape[1] + 1)})
+        for sheet_name, sheet in sheets.items()
+    }, engine)
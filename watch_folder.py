@@ -0,0 +1,199 @@
+# Watch-folder mode: clean every Survey Monkey export dropped into an inbox folder and write the cleaned
+# workbooks to an outbox folder. A manifest of content hashes in the outbox records what has been processed
+# (or has failed), so restarts and re-dropped copies of a file skip work already done.
+#
+#   python watch_folder.py --inbox /shared/inbox --outbox /shared/outbox
+#
+# Files are only picked up once their size and modification time have stopped changing for --debounce
+# seconds, so exports still being copied into the inbox are left alone.
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+import metrics
+from engine import clean_workbook, content_hash
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+# Define helper function to load the manifest ({content hash: record}), or start an empty one
+def load_manifest(outbox):
+    try:
+        with open(os.path.join(outbox, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+# Define helper function to save the manifest atomically, so a crash never leaves it half written
+def save_manifest(outbox, manifest):
+    path = os.path.join(outbox, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+# Define helper function to list the exports in the inbox, skipping Excel lock files and hidden files
+def list_inbox(inbox):
+    candidates = {}
+    for entry in os.scandir(inbox):
+        if not entry.is_file() or entry.name.startswith(("~$", ".")) or not entry.name.endswith(".xlsx"):
+            continue
+        stat = entry.stat()
+        candidates[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return candidates
+
+
+# Clean one export in a worker process and write the cleaned workbook to the outbox. Returns the manifest
+# record and the metrics recorded while cleaning (for the parent process to merge); errors are recorded
+# rather than raised so one bad export doesn't stop the daemon.
+def process_file(path, file_bytes, outbox, all_sheets=False):
+    # start from an empty registry, so only this file's metrics are sent back to the parent
+    metrics.collect()
+
+    file_name = os.path.basename(path)
+    record = {
+        "file_name": file_name,
+        "processed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+    try:
+        cleaned = clean_workbook(file_name, file_bytes, all_sheets=all_sheets)
+    except Exception as error:
+        record.update(status="failed", error=str(error))
+        return record, metrics.collect()
+
+    # write next to a temporary name first so consumers of the outbox never see a partial workbook
+    output_path = os.path.join(outbox, cleaned.file_name)
+    with open(output_path + ".tmp", "wb") as output_file:
+        output_file.write(cleaned.data)
+    os.replace(output_path + ".tmp", output_path)
+
+    record.update(status="cleaned", output=cleaned.file_name, sheets=[
+        {"sheet": sheet.sheet_name, "template": sheet.template}
+        for sheet in cleaned.sheets])
+    if cleaned.peak_memory is not None:
+        record["peak_memory_mib"] = round(cleaned.peak_memory / 2**20, 1)
+    return record, metrics.collect()
+
+
+# Watch the inbox until interrupted (or, with once=True, until everything currently there is processed)
+def watch(inbox, outbox, workers=None, interval=2.0, debounce=5.0, once=False, all_sheets=False,
+          metrics_file=None):
+    os.makedirs(outbox, exist_ok=True)
+    manifest = load_manifest(outbox)
+
+    # path -> ((size, mtime), time that signature was first seen) for files that may still be being written
+    pending = {}
+    # path -> (size, mtime) of files already hashed, so settled files are not re-read on every scan
+    hashed = {}
+    # content hashes currently in the worker pool -> future
+    running = {}
+
+    # start the workers from a fork server: forking this process directly could copy the metrics lock while
+    # the metrics server thread holds it, and the worker would then hang on its first metrics update
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        while True:
+            now = time.monotonic()
+            candidates = list_inbox(inbox)
+
+            # smallest files first, so quick exports aren't held up behind large ones
+            for path, signature in sorted(candidates.items(), key=lambda candidate: candidate[1][0]):
+                if hashed.get(path) == signature:
+                    continue
+
+                seen_signature, since = pending.get(path, (None, now))
+                if signature != seen_signature:
+                    pending[path] = (signature, now)
+                    if not once:
+                        continue
+                elif now - since < debounce and not once:
+                    continue
+
+                # the file has stopped changing: hash it and queue it unless its content was seen before
+                del pending[path]
+                with open(path, "rb") as input_file:
+                    file_bytes = input_file.read()
+                digest = content_hash(file_bytes)
+                hashed[path] = signature
+                if digest in manifest or digest in running:
+                    continue
+                running[digest] = pool.submit(
+                    process_file, path, file_bytes, outbox, all_sheets)
+
+            # forget files that disappeared from the inbox
+            for path in set(pending) - set(candidates):
+                del pending[path]
+            for path in set(hashed) - set(candidates):
+                del hashed[path]
+
+            # record finished files, waiting at most one polling interval for more to finish (this wait stands
+            # in for the polling sleep, so a finished file is recorded as soon as it is done)
+            waited = bool(running)
+            if running:
+                done, _ = wait(running.values(), timeout=None if once else interval,
+                               return_when=FIRST_COMPLETED)
+                for digest, future in list(running.items()):
+                    if future in done:
+                        record, worker_metrics = future.result()
+                        metrics.merge(worker_metrics)
+                        manifest[digest] = record
+                        del running[digest]
+                        print(f"{record['status']}: {record['file_name']}"
+                              + (f" ({record['error']})" if record["status"] == "failed" else ""), flush=True)
+                if done:
+                    save_manifest(outbox, manifest)
+
+            metrics.set_gauge("cleaning_queue_depth", len(pending) + len(running))
+            metrics.write_textfile(metrics_file)
+
+            if once and not running and not pending:
+                return manifest
+            if not once and not waited:
+                time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Clean Survey Monkey exports dropped into an inbox folder.")
+    parser.add_argument("--inbox", required=True,
+                        help="folder to watch for raw exports")
+    parser.add_argument("--outbox", required=True,
+                        help="folder for the cleaned workbooks and the manifest")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between inbox scans")
+    parser.add_argument("--debounce", type=float, default=5.0,
+                        help="seconds a file must stay unchanged before it is picked up")
+    parser.add_argument("--once", action="store_true",
+                        help="process what is in the inbox now and exit")
+    parser.add_argument("--all-sheets", action="store_true",
+                        help="clean every survey sheet of each workbook, not just the active one")
+    parser.add_argument("--metrics-file",
+                        help="write Prometheus metrics to this file after every scan "
+                             "(default: $CLEANING_APP_METRICS_FILE, if set)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this port at /metrics "
+                             "(default: $CLEANING_APP_METRICS_PORT, if set)")
+    parser.add_argument("--metrics-host",
+                        help="interface the metrics endpoint listens on "
+                             "(default: $CLEANING_APP_METRICS_HOST, or 127.0.0.1)")
+    args = parser.parse_args(argv)
+
+    metrics.serve(args.metrics_port, args.metrics_host)
+    try:
+        watch(args.inbox, args.outbox, args.workers,
+              args.interval, args.debounce, args.once, args.all_sheets, args.metrics_file)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
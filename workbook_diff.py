@@ -0,0 +1,354 @@
+# Workbook differ: gates engine changes by comparing cleaned workbooks cell by cell (values, number formats,
+# fonts, alignment), plus column widths and merged ranges, against the output of the current implementation.
+#
+# Take a snapshot of the current output, change the engine, take another and compare the two:
+#
+#   python workbook_diff.py snapshot baseline/ --synthetic 50 --inbox samples/
+#   python workbook_diff.py snapshot candidate/ --synthetic 50 --inbox samples/
+#   python workbook_diff.py compare baseline/ candidate/
+#
+# Both sheets are streamed row by row in read-only mode, so large workbooks are never fully loaded, and
+# file pairs are spread over worker processes. `compare` exits with status 1 if anything differs.
+
+import argparse
+import csv
+import io
+import os
+import posixpath
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import zip_longest
+from xml.etree.ElementTree import iterparse
+
+import openpyxl
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.styles import Alignment
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+from engine import clean_workbook, cleaned_name
+from synthetic import TEMPLATES, make_export
+
+
+# namespaces of the spreadsheet parts read directly from the xlsx package
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_RELATIONSHIP_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# suffix of the files recording why an export could not be cleaned, so changed errors are caught too
+ERROR_SUFFIX = ".error.txt"
+
+# differences reported per file pair (all of them are counted)
+MAX_DIFFS = 20
+
+
+# Define helper function to list the comparable files under a folder, as paths relative to it
+def list_outputs(folder):
+    outputs = []
+    for root, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            if file_name.endswith((".xlsx", ERROR_SUFFIX)) and not file_name.startswith("~$"):
+                outputs.append(os.path.relpath(
+                    os.path.join(root, file_name), folder))
+    return sorted(outputs)
+
+
+# Define helper function to map every sheet name to its part inside the xlsx package
+def sheet_parts(package):
+    targets = {}
+    for _, element in iterparse(io.BytesIO(package.read("xl/_rels/workbook.xml.rels"))):
+        if element.tag == f"{PACKAGE_RELATIONSHIP_NS}Relationship":
+            target = element.get("Target")
+            targets[element.get("Id")] = target.lstrip("/") if target.startswith("/") \
+                else posixpath.normpath(posixpath.join("xl", target))
+
+    sheets = {}
+    for _, element in iterparse(io.BytesIO(package.read("xl/workbook.xml"))):
+        if element.tag == f"{MAIN_NS}sheet":
+            sheets[element.get("name")] = targets[element.get(f"{RELATIONSHIP_NS}id")]
+    return sheets
+
+
+# Define helper function to read a sheet's column widths and merged ranges straight from the package. Read-only
+# mode doesn't expose either; the rows are dropped as they are parsed.
+def sheet_layout(package, part):
+    widths = {}
+    merged = set()
+    with package.open(part) as sheet_xml:
+        for _, element in iterparse(sheet_xml):
+            if element.tag == f"{MAIN_NS}col":
+                for column in range(int(element.get("min")), int(element.get("max")) + 1):
+                    widths[get_column_letter(column)] = float(element.get("width", 0))
+            elif element.tag == f"{MAIN_NS}mergeCell":
+                merged.add(element.get("ref"))
+            elif element.tag == f"{MAIN_NS}row":
+                element.clear()
+    return widths, merged
+
+
+# Define helper function to read the CRC of every part of the package from the zip directory, without
+# decompressing anything
+def part_checksums(package):
+    return {info.filename: info.CRC for info in package.infolist()}
+
+
+# Define helper function to describe a cell's number format, font and alignment as comparable values. Cells
+# missing from the sheet have the default style.
+def cell_style(cell):
+    if cell is EMPTY_CELL:
+        return DEFAULT_STYLE
+
+    font = cell.font
+    color = getattr(font.color, font.color.type, None) if font.color is not None else None
+    alignment = cell.alignment
+    return (cell.number_format,
+            (font.name, font.sz, font.b, font.i, font.u, color),
+            (alignment.horizontal, alignment.vertical, alignment.wrap_text))
+
+
+# style of a cell nobody has formatted, as described by cell_style
+DEFAULT_STYLE = (
+    "General",
+    (DEFAULT_FONT.name, DEFAULT_FONT.sz, DEFAULT_FONT.b, DEFAULT_FONT.i, DEFAULT_FONT.u,
+     getattr(DEFAULT_FONT.color, DEFAULT_FONT.color.type, None)),
+    (Alignment().horizontal, Alignment().vertical, Alignment().wrap_text))
+
+
+# Define helper function to compare two cell values, allowing for float noise
+def same_value(expected, actual, tolerance):
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)) \
+            and not isinstance(expected, bool) and not isinstance(actual, bool):
+        return abs(expected - actual) <= tolerance
+    return expected == actual
+
+
+# Define helper function to describe cells' styles through a per-workbook cache keyed by the cell's style
+# record, since a sheet holds thousands of cells but only a handful of distinct styles
+def cached_style(cell, cache):
+    if cell is EMPTY_CELL:
+        return DEFAULT_STYLE
+    key = tuple(cell.style_array)
+    style = cache.get(key)
+    if style is None:
+        style = cache[key] = cell_style(cell)
+    return style
+
+
+# Compare two xlsx files and return their differences as (sheet, location, aspect, expected, actual) tuples,
+# with the total number of differences (only the first max_diffs are kept). A sheet whose part, styles and
+# shared strings all have the same checksum in both files is identical and is skipped without being read.
+def diff_workbooks(expected_path, actual_path, tolerance=1e-9, max_diffs=MAX_DIFFS):
+    differences = []
+    count = 0
+
+    def report(sheet, location, aspect, expected, actual):
+        nonlocal count
+        count += 1
+        if len(differences) < max_diffs:
+            differences.append((sheet, location, aspect, expected, actual))
+
+    with zipfile.ZipFile(expected_path) as expected_package, zipfile.ZipFile(actual_path) as actual_package:
+        expected_parts = sheet_parts(expected_package)
+        actual_parts = sheet_parts(actual_package)
+        if list(expected_parts) != list(actual_parts):
+            report("", "", "sheets", list(expected_parts), list(actual_parts))
+
+        expected_checksums = part_checksums(expected_package)
+        actual_checksums = part_checksums(actual_package)
+        shared_parts = ["xl/styles.xml", "xl/sharedStrings.xml"]
+        same_shared = all(expected_checksums.get(part) == actual_checksums.get(part)
+                          for part in shared_parts)
+
+        changed = [name for name in expected_parts if name in actual_parts and not (
+            same_shared and expected_checksums.get(expected_parts[name]) == actual_checksums.get(actual_parts[name]))]
+
+        for name in changed:
+            expected_widths, expected_merged = sheet_layout(expected_package, expected_parts[name])
+            actual_widths, actual_merged = sheet_layout(actual_package, actual_parts[name])
+            for column in sorted(set(expected_widths) | set(actual_widths)):
+                if expected_widths.get(column) != actual_widths.get(column):
+                    report(name, column, "column width",
+                           expected_widths.get(column), actual_widths.get(column))
+            for cell_range in sorted(expected_merged ^ actual_merged):
+                report(name, cell_range, "merged range",
+                       cell_range in expected_merged, cell_range in actual_merged)
+
+    if not changed:
+        return differences, count
+
+    expected_wb = openpyxl.load_workbook(expected_path, read_only=True)
+    actual_wb = openpyxl.load_workbook(actual_path, read_only=True)
+    expected_styles = {}
+    actual_styles = {}
+    try:
+        for name in changed:
+            expected_rows = expected_wb[name].iter_rows()
+            actual_rows = actual_wb[name].iter_rows()
+
+            # stream both sheets together; a missing row or cell compares like an empty, unstyled one
+            for row, (expected_row, actual_row) in enumerate(zip_longest(expected_rows, actual_rows, fillvalue=()),
+                                                             start=1):
+                for column, (expected_cell, actual_cell) in enumerate(
+                        zip_longest(expected_row, actual_row, fillvalue=EMPTY_CELL), start=1):
+                    location = f"{get_column_letter(column)}{row}"
+                    if not same_value(expected_cell.value, actual_cell.value, tolerance):
+                        report(name, location, "value",
+                               expected_cell.value, actual_cell.value)
+
+                    expected_format, expected_font, expected_alignment = cached_style(
+                        expected_cell, expected_styles)
+                    actual_format, actual_font, actual_alignment = cached_style(
+                        actual_cell, actual_styles)
+                    if expected_format != actual_format:
+                        report(name, location, "number format",
+                               expected_format, actual_format)
+                    if expected_font != actual_font:
+                        report(name, location, "font",
+                               expected_font, actual_font)
+                    if expected_alignment != actual_alignment:
+                        report(name, location, "alignment",
+                               expected_alignment, actual_alignment)
+    finally:
+        expected_wb.close()
+        actual_wb.close()
+
+    return differences, count
+
+
+# Compare one pair of outputs (a worker task). Returns (relative path, differences, difference count).
+def diff_pair(relative_path, expected_folder, actual_folder, tolerance=1e-9, max_diffs=MAX_DIFFS):
+    expected_path = os.path.join(expected_folder, relative_path)
+    actual_path = os.path.join(actual_folder, relative_path)
+
+    if not os.path.exists(expected_path) or not os.path.exists(actual_path):
+        side = "expected" if not os.path.exists(expected_path) else "actual"
+        return relative_path, [("", "", "file", f"missing from {side}", "")], 1
+
+    if relative_path.endswith(ERROR_SUFFIX):
+        with open(expected_path) as expected_file, open(actual_path) as actual_file:
+            expected, actual = expected_file.read(), actual_file.read()
+        return relative_path, [] if expected == actual else [("", "", "error", expected, actual)], int(expected != actual)
+
+    try:
+        differences, count = diff_workbooks(
+            expected_path, actual_path, tolerance, max_diffs)
+    except Exception as error:
+        return relative_path, [("", "", "unreadable", "", str(error))], 1
+    return relative_path, differences, count
+
+
+# Compare every output of two snapshot folders, in parallel. Returns {relative path: (differences, count)}
+# for the pairs that differ, and the number of pairs compared.
+def compare_folders(expected_folder, actual_folder, workers=None, tolerance=1e-9, max_diffs=MAX_DIFFS):
+    relative_paths = sorted(set(list_outputs(expected_folder)) | set(
+        list_outputs(actual_folder)))
+
+    # hand the pairs out in chunks, so thousands of small files don't cost one round trip each
+    chunksize = max(1, len(relative_paths) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(partial(diff_pair, expected_folder=expected_folder, actual_folder=actual_folder,
+                                   tolerance=tolerance, max_diffs=max_diffs),
+                           relative_paths, chunksize=chunksize)
+        differing = {relative_path: (differences, count)
+                     for relative_path, differences, count in results if count}
+
+    return differing, len(relative_paths)
+
+
+# Clean one export into the snapshot folder (a worker task), recording the error message if it fails
+def snapshot_file(relative_path, file_bytes, output_folder, all_sheets=False):
+    output_path = os.path.join(output_folder, os.path.dirname(
+        relative_path), cleaned_name(os.path.basename(relative_path)))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    try:
+        cleaned = clean_workbook(os.path.basename(
+            relative_path), file_bytes, all_sheets=all_sheets)
+    except Exception as error:
+        with open(output_path + ERROR_SUFFIX, "w") as error_file:
+            error_file.write(f"{type(error).__name__}: {error}\n")
+        return
+
+    with open(output_path, "wb") as output_file:
+        output_file.write(cleaned.data)
+
+
+# Define helper function to yield the exports of a snapshot: every xlsx under the inbox (the real samples)
+# and `synthetic` generated exports of each template
+def corpus(inbox=None, synthetic=0, seed=0):
+    if inbox:
+        for relative_path in list_outputs(inbox):
+            if relative_path.endswith(".xlsx"):
+                with open(os.path.join(inbox, relative_path), "rb") as input_file:
+                    yield relative_path, input_file.read()
+
+    for index in range(synthetic):
+        for template in TEMPLATES:
+            yield os.path.join("synthetic", f"{template} {seed + index}.xlsx"), make_export(template, seed + index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Snapshot the cleaned output of a corpus, or compare two snapshots cell by cell.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snapshot = commands.add_parser(
+        "snapshot", help="clean a corpus of exports into a folder")
+    snapshot.add_argument("output", help="folder for the cleaned workbooks")
+    snapshot.add_argument(
+        "--inbox", help="folder of real sample exports (searched recursively)")
+    snapshot.add_argument("--synthetic", type=int, default=0,
+                          help="synthetic exports to generate per template")
+    snapshot.add_argument("--seed", type=int, default=0)
+    snapshot.add_argument("--all-sheets", action="store_true",
+                          help="clean every survey sheet of each workbook")
+    snapshot.add_argument("--workers", type=int, default=None,
+                          help="worker processes (default: one per CPU)")
+
+    compare = commands.add_parser(
+        "compare", help="compare two snapshot folders")
+    compare.add_argument("expected", help="snapshot of the current implementation")
+    compare.add_argument("actual", help="snapshot of the changed implementation")
+    compare.add_argument("--tolerance", type=float, default=1e-9,
+                         help="largest difference between two numbers that still counts as equal")
+    compare.add_argument("--max-diffs", type=int, default=MAX_DIFFS,
+                         help="differences listed per file")
+    compare.add_argument("--csv", help="also write every listed difference to this CSV file")
+    compare.add_argument("--workers", type=int, default=None,
+                         help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(snapshot_file, relative_path, file_bytes, args.output, args.all_sheets)
+                       for relative_path, file_bytes in corpus(args.inbox, args.synthetic, args.seed)]
+            for future in futures:
+                future.result()
+        print(f"{len(futures)} exports cleaned into {args.output}")
+        return 0
+
+    differing, compared = compare_folders(
+        args.expected, args.actual, args.workers, args.tolerance, args.max_diffs)
+
+    for relative_path, (differences, count) in sorted(differing.items()):
+        print(f"{relative_path}: {count} difference(s)")
+        for sheet, location, aspect, expected, actual in differences:
+            print(f"  {sheet}!{location} {aspect}: {expected!r} -> {actual!r}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["File", "Sheet", "Location",
+                            "Aspect", "Expected", "Actual"])
+            for relative_path, (differences, _) in sorted(differing.items()):
+                writer.writerows((relative_path,) + difference
+                                 for difference in differences)
+
+    print(f"{compared} file(s) compared, {len(differing)} differ")
+    return 1 if differing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# Writers for the workbooks the app generates from scratch (Leader-Team comparisons, rollups). The cleaned
+# survey workbooks are edited in place and always go through openpyxl.
+
+import importlib.util
+import io
+import os
+
+import openpyxl
+import pandas as pd
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+
+# xlsxwriter is optional; without it the fast path uses openpyxl's write-only mode
+HAS_XLSXWRITER = importlib.util.find_spec("xlsxwriter") is not None
+
+
+# 'auto' picks the fastest engine that is installed: xlsxwriter, then openpyxl in write-only mode. Set the
+# CLEANING_APP_WRITER environment variable to 'xlsxwriter', 'openpyxl-write-only' or 'openpyxl' to force one.
+WRITER_ENGINE = os.environ.get("CLEANING_APP_WRITER", "auto")
+WRITER_ENGINES = ["auto", "xlsxwriter", "openpyxl-write-only", "openpyxl"]
+
+# same header style pandas uses when it writes a DataFrame to Excel
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"),
+                       top=Side(style="thin"), bottom=Side(style="thin"))
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+
+# Define helper function to resolve the configured engine to one that can actually be used
+def resolve_engine(engine=None):
+    engine = engine or WRITER_ENGINE
+    if engine not in WRITER_ENGINES:
+        raise ValueError(
+            f"Unknown writer engine '{engine}'. Choose one of: {', '.join(WRITER_ENGINES)}.")
+
+    if engine == "auto" or (engine == "xlsxwriter" and not HAS_XLSXWRITER):
+        return "xlsxwriter" if HAS_XLSXWRITER else "openpyxl-write-only"
+    return engine
+
+
+# Define helper function to stream DataFrames into a write-only openpyxl workbook, one row at a time
+def _write_openpyxl_write_only(buffer, sheets):
+    wb = openpyxl.Workbook(write_only=True)
+    for sheet_name, (df, column_widths) in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+
+        # column widths have to be set before the first row is written
+        for column_letter, width in column_widths.items():
+            ws.column_dimensions[column_letter].width = width
+
+        header = []
+        for column in df.columns:
+            cell = WriteOnlyCell(ws, value=str(column))
+            cell.font = HEADER_FONT
+            cell.border = HEADER_BORDER
+            cell.alignment = HEADER_ALIGNMENT
+            header.append(cell)
+        ws.append(header)
+
+        # blanks become empty cells, like DataFrame.to_excel
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+
+    wb.save(buffer)
+
+
+# Define helper function to write DataFrames through pandas (xlsxwriter or regular openpyxl)
+def _write_pandas(buffer, sheets, engine):
+    with pd.ExcelWriter(buffer, engine=engine) as writer:
+        for sheet_name, (df, column_widths) in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+            # Access the worksheet to set column widths
+            worksheet = writer.sheets[sheet_name]
+            for column_letter, width in column_widths.items():
+                if engine == "xlsxwriter":
+                    worksheet.set_column(
+                        f"{column_letter}:{column_letter}", width)
+                else:
+                    worksheet.column_dimensions[column_letter].width = width
+
+
+# Write a freshly generated workbook. `sheets` maps each sheet name to a (DataFrame, {column letter: width})
+# tuple. Returns a BytesIO positioned at the start.
+def write_workbook(sheets, engine=None):
+    engine = resolve_engine(engine)
+
+    buffer = io.BytesIO()
+    if engine == "openpyxl-write-only":
+        _write_openpyxl_write_only(buffer, sheets)
+    else:
+        _write_pandas(buffer, sheets, engine)
+
+    # Move to the beginning of the BytesIO buffer
+    buffer.seek(0)
+    return buffer